@@ -3,103 +3,200 @@ from datetime import datetime
 from .blockchainscan import BlockChainScan
 from .utils import Int2HexStr, HexStr2Int, check_dict
 from .nft import NFT
+from .events import EVENTS
 
 TRANS_CACHE = {}
+ATTRIBUTIONS = ['equal', 'units', 'full']
+
+def cache_transactions(transactions:list[dict]):
+    """
+        Keep normal transactions (txlist) by hash, so that token transfers
+        do not need to retrieve them one by one
+    """
+    for tr in transactions:
+        # print(tr)
+        check_dict(tr)
+        txhash = HexStr2Int(tr['hash'])
+        if Int2HexStr(txhash) not in TRANS_CACHE:
+            TRANS_CACHE[Int2HexStr(txhash)] = {}
+            TRANS_CACHE[Int2HexStr(txhash)]['date'] = datetime.fromtimestamp(int(tr['timeStamp']))
+            TRANS_CACHE[Int2HexStr(txhash)]['hash'] = txhash
+            TRANS_CACHE[Int2HexStr(txhash)]['from'] = HexStr2Int(tr['from'])
+            TRANS_CACHE[Int2HexStr(txhash)]['to'] = HexStr2Int(tr['to'])
+            TRANS_CACHE[Int2HexStr(txhash)]['value'] = int(tr['value'])
+            TRANS_CACHE[Int2HexStr(txhash)]['methodId'] = HexStr2Int(tr['methodId'])
 
 class AddressTransactions:
 
-    def __init__(self, address:str, ps:BlockChainScan):
+    def __init__(self, address:str, ps:BlockChainScan, attribution:str='equal'):
         self.address = address
         self.ps = ps
         self.network = ps.network
+        # How the value of a transaction is split across the tokens it moves
+        self.attribution = attribution
         
         self.NFTs = []
 
     
     
-    def get_transactions(self, address:str=None):
+    def get_transactions(self, address:str=None, startblock:int=0, endblock:int=99999999):
         if address == None:
             target_addr = self.address
         else:
             target_addr = address
-        transactions = self.ps.get_normal_transactions(address=target_addr)
+        transactions = self.ps.get_normal_transactions(address=target_addr, startblock=startblock, endblock=endblock)
         if transactions == None:
-            print(f'No  transactions for {Int2HexStr(target_addr)}')
+            EVENTS.info('no_transactions', f'No  transactions for {Int2HexStr(target_addr)}', address=Int2HexStr(target_addr))
             return False
-        print(f'{len(transactions)} Normal transactions for {Int2HexStr(target_addr)}')
-        for tr in transactions:
-            # print(tr)
-            check_dict(tr)
-            txhash = HexStr2Int(tr['hash'])
-            if Int2HexStr(txhash) not in TRANS_CACHE:
-                TRANS_CACHE[Int2HexStr(txhash)] = {}
-                TRANS_CACHE[Int2HexStr(txhash)]['date'] = datetime.fromtimestamp(int(tr['timeStamp']))
-                TRANS_CACHE[Int2HexStr(txhash)]['hash'] = txhash
-                TRANS_CACHE[Int2HexStr(txhash)]['from'] = HexStr2Int(tr['from'])
-                TRANS_CACHE[Int2HexStr(txhash)]['to'] = HexStr2Int(tr['to'])
-                TRANS_CACHE[Int2HexStr(txhash)]['value'] = int(tr['value'])
-                TRANS_CACHE[Int2HexStr(txhash)]['methodId'] = HexStr2Int(tr['methodId'])
+        EVENTS.info('transactions', f'{len(transactions)} Normal transactions for {Int2HexStr(target_addr)}', address=Int2HexStr(target_addr), count=len(transactions))
+        cache_transactions(transactions)
         return True
     
-    def parse_token_transfers(self, transfers, tokentype):
-        for tr in transfers:
-            # print(f"tr is {tr}")
-            check_dict(tr)
-            tokenID = int(tr['tokenID'])
-            tr_date = datetime.fromtimestamp(int(tr['timeStamp']))
-            tr_from = HexStr2Int(tr['from'])
-            tr_to = HexStr2Int(tr['to'])
-            contractAddress = HexStr2Int(tr['contractAddress'])
-            if tokentype == 'ERC1155':
-                tokenValue = int(tr['tokenValue'])
-            elif tokentype == 'ERC721':
-                tokenValue = 1
-            else:
-                raise Exception(f'Token type {tokentype} not supported!')
-            
-            tokenName = tr['tokenName']
-            txhash = HexStr2Int(tr['hash'])
-            transaction = self.retrieve_transaction(txhash)
-            if transaction == None:
-                # print(f'Transaction hash {Int2HexStr(txhash)} not found, trying to retrieve it')
-                transaction = self.ps.get_transaction(txhash)
+    def parse_token_transfers(self, transfers:dict):
+        """
+            Update the NFTs with the token transfers of the wallet,
+            given per token type ({'ERC1155': [...], 'ERC721': [...]})
+        """
+        self.apply_token_transfers(self.prepare_token_transfers(transfers))
+        return True
 
-                if transaction == None:
-                    # We fall back to calculating each transaction
-                    # for the other address
-                    # breakpoint()
-                    if self.address == tr_from:
-                        self.get_transactions(address=tr_to)
-                    else:
-                        self.get_transactions(address=tr_from)
-                    
-                    transaction = self.retrieve_transaction(txhash)
-                    
-                    if transaction == None:
-                        # Nothing to do anymore
-                        raise Exception(f'Transaction hash {Int2HexStr(txhash)} not found')
+    def prepare_token_transfers(self, transfers:dict) -> list[tuple]:
+        """
+            Group the transfers of all the token types by transaction, resolve each
+            transaction once and split its value across all the tokens it moves.
+            Only the transactions are retrieved, the NFTs are not touched
+        """
+        rows = []
+        for tokentype, type_transfers in transfers.items():
+            for tr in type_transfers:
+                # print(f"tr is {tr}")
+                check_dict(tr)
+                if tokentype == 'ERC1155':
+                    tokenValue = int(tr['tokenValue'])
+                elif tokentype == 'ERC721':
+                    tokenValue = 1
+                else:
+                    raise Exception(f'Token type {tokentype} not supported!')
+                rows.append({
+                    'blockNumber': int(tr['blockNumber']),
+                    'hash': HexStr2Int(tr['hash']),
+                    'tokentype': tokentype,
+                    'tokenID': int(tr['tokenID']),
+                    'date': datetime.fromtimestamp(int(tr['timeStamp'])),
+                    'from': HexStr2Int(tr['from']),
+                    'to': HexStr2Int(tr['to']),
+                    'contractAddress': HexStr2Int(tr['contractAddress']),
+                    'tokenValue': tokenValue,
+                    'tokenName': tr['tokenName'],
+                })
+        # Both lists are in block order, merge them (the sort is stable)
+        rows.sort(key=lambda row: row['blockNumber'])
 
+        # Group the transfers by transaction, keeping the order
+        # in which the transactions first appear
+        groups = {}
+        for row in rows:
+            if row['hash'] not in groups:
+                groups[row['hash']] = []
+            groups[row['hash']].append(row)
+
+        prepared = []
+        for txhash, group in groups.items():
+            # A single lookup for all the tokens moved by the transaction
+            transaction = self.resolve_transaction(txhash, group[0]['from'], group[0]['to'])
+            check_dict(transaction)
+            values = self.attribute_value(NFT.get_value(transaction), group)
+            prepared.append((group, transaction, values))
+        return prepared
+
+    def apply_token_transfers(self, prepared:list[tuple]):
+        for group, transaction, values in prepared:
             # breakpoint()
-            nft = self.retrieve_nft(tokenID, contractAddress, self.network)
-            nft.update_nft(self.address, tr_date, tr_from, tr_to, contractAddress, tokenValue, tokenName, transaction)
-        return True
+            for i in range(len(group)):
+                tr = group[i]
+                nft = self.retrieve_nft(tr['tokenID'], tr['contractAddress'], self.network)
+                nft.update_nft(self.address, tr['date'], tr['from'], tr['to'], tr['contractAddress'], tr['tokenValue'], tr['tokenName'], transaction, values[i])
 
-    def set_ERC1155_transfers(self):
-        transfers = self.ps.get_ERC1155_token_transfers(address=self.address, contract_address=None)
-        if transfers == None:
-            print(f'No ERC1155 token transfers for {Int2HexStr(self.address)}')
-            return False
-        print(f'{len(transfers)} ERC1155 token transfers for {Int2HexStr(self.address)}')
-        return self.parse_token_transfers(transfers, 'ERC1155')
+    def resolve_transaction(self, txhash, tr_from, tr_to):
+        transaction = self.retrieve_transaction(txhash)
+        if transaction == None:
+            # print(f'Transaction hash {Int2HexStr(txhash)} not found, trying to retrieve it')
+            transaction = self.ps.get_transaction(txhash)
 
-    def set_ERC721_transfers(self):
-        transfers = self.ps.get_ERC721_token_transfers(address=self.address, contract_address=None)
-        if transfers == None:
-            print(f'No ERC721 token transfers for {Int2HexStr(self.address)}')
-            return False
-        # breakpoint()
-        print(f'{len(transfers)} ERC721 token transfers for {Int2HexStr(self.address)}')
-        return self.parse_token_transfers(transfers, 'ERC721')
+            if transaction != None:
+                # Keep it for the other wallets involved
+                TRANS_CACHE[Int2HexStr(txhash)] = transaction
+            else:
+                # We fall back to calculating each transaction
+                # for the other address
+                # breakpoint()
+                if self.address == tr_from:
+                    self.get_transactions(address=tr_to)
+                else:
+                    self.get_transactions(address=tr_from)
+                
+                transaction = self.retrieve_transaction(txhash)
+                
+                if transaction == None:
+                    # Nothing to do anymore
+                    raise Exception(f'Transaction hash {Int2HexStr(txhash)} not found')
+        return transaction
+
+    def attribute_value(self, value:int, group:list[dict]) -> list[int]:
+        """
+            Split the value of a transaction across the tokens it moves:
+            'equal' gives the same share to each token, 'units' shares it by the
+            amount of tokens transferred (ERC1155), 'full' gives the whole value
+            to every token (counting it several times, as before grouping).
+            A group holds the ERC1155 and ERC721 tokens of the transaction.
+            Self transfers are ignored by NFT.update_nft and get no share
+        """
+        if self.attribution == 'full':
+            return [value for tr in group]
+        if self.attribution == 'equal':
+            weights = [0 if tr['from'] == tr['to'] else 1 for tr in group]
+        elif self.attribution == 'units':
+            weights = [0 if tr['from'] == tr['to'] else tr['tokenValue'] for tr in group]
+        else:
+            raise Exception(f'Attribution {self.attribution} not supported')
+
+        total_weight = sum(weights)
+        if total_weight == 0:
+            return [0 for tr in group]
+        values = [value * weight // total_weight for weight in weights]
+        # The wei lost in the integer division go to the first tokens
+        remainder = value - sum(values)
+        for i in range(len(group)):
+            if remainder == 0:
+                break
+            if weights[i] > 0:
+                values[i] += 1
+                remainder -= 1
+        return values
+
+    def get_token_transfers(self, startblock:int=0, endblock:int=99999999) -> dict:
+        """
+            ERC1155 and ERC721 transfers of the wallet. A list that could not be
+            retrieved is reported as an error and left out, the other one is kept
+        """
+        transfers = {}
+        for tokentype, get_transfers in [('ERC1155', self.ps.get_ERC1155_token_transfers), ('ERC721', self.ps.get_ERC721_token_transfers)]:
+            type_transfers = get_transfers(address=self.address, contract_address=None, startblock=startblock, endblock=endblock)
+            if type_transfers == None:
+                EVENTS.error('transfers_failed', f'Could not retrieve the {tokentype} token transfers of {Int2HexStr(self.address)}', address=Int2HexStr(self.address), tokentype=tokentype)
+                continue
+            EVENTS.info('transfers', f'{len(type_transfers)} {tokentype} token transfers for {Int2HexStr(self.address)}', address=Int2HexStr(self.address), tokentype=tokentype, count=len(type_transfers))
+            transfers[tokentype] = type_transfers
+        return transfers
+
+    def set_token_transfers(self, startblock:int=0, endblock:int=99999999):
+        """
+            Returns False if a token type could not be retrieved,
+            the transfers of the other one are still applied
+        """
+        transfers = self.get_token_transfers(startblock=startblock, endblock=endblock)
+        self.parse_token_transfers(transfers)
+        return len(transfers) == 2
 
     def retrieve_nft(self, id, contractAddress, network):
         key = NFT.gen_key(id, contractAddress)
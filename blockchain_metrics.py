@@ -1,87 +1,87 @@
-from .utils import read_yaml, Int2HexStr, HexStr2Int, make_percentage
+from tqdm import tqdm
+
+from .utils import read_yaml, write_yaml, Int2HexStr, HexStr2Int, make_percentage, ratio
 from .blockchainscan import BlockChainScan
-from .addresstransactions import AddressTransactions
+from .addresstransactions import AddressTransactions, ATTRIBUTIONS
+from .eventlogs import metrics_from_logs, read_recorded_logs
+from .planner import plan_wallets, plan_logs
+from .history import write_history
+from .events import EVENTS
+from .nft import NFT
 
 
 SETTINGS_FILE = '.settings.yaml'
 WEI_TO_POL = 10**18
 
-def create_scanner(network):
-    settings = read_yaml(SETTINGS_FILE)
+def create_scanner(network, settings_file=SETTINGS_FILE):
+    settings = read_yaml(settings_file)
 
     token = settings[f'{network}']['token']
     calls_sec = settings[f'{network}']['calls_sec']
     endpoint = settings[f'{network}']['endpoint']
 
-    bs = BlockChainScan(network, endpoint, token, calls_sec)
+    calls_day = settings[f'{network}'].get('calls_day')
+
+    bs = BlockChainScan(network, endpoint, token, calls_sec, calls_day)
     return bs
 
 
-def metrics_per_wallet(wallets, bs):
+def metrics_per_wallet(wallets, bs, estimates:dict=None, attribution:str='equal'):
     total_metrics = []
+    incomplete = 0
+    if estimates == None:
+        progress = tqdm(total=len(wallets), unit='wallet', disable=EVENTS.quiet)
+    else:
+        progress = tqdm(total=sum(estimates[wallet] for wallet in wallets), unit='call', disable=EVENTS.quiet)
     for wallet in wallets:
-            print(f'######## Address {Int2HexStr(wallet)} ########')
+            EVENTS.info('wallet', f'######## Address {Int2HexStr(wallet)} ########', address=Int2HexStr(wallet))
+            progress.update(1 if estimates == None else estimates[wallet])
 
-            addr_metrics = AddressTransactions(wallet, bs)
+            addr_metrics = AddressTransactions(wallet, bs, attribution)
             
             if not addr_metrics.get_transactions():
                 continue
             
-            addr_metrics.set_ERC1155_transfers()
-
-            addr_metrics.set_ERC721_transfers()
+            if not addr_metrics.set_token_transfers():
+                incomplete += 1
             
             total_metrics.append(addr_metrics)
     
+    progress.close()
+    if incomplete > 0:
+        EVENTS.warning('incomplete_wallets', f'WARNING: the token transfers of {incomplete} wallets could not all be retrieved, their NFTs are incomplete', count=incomplete)
     return total_metrics
             
 
-def calculate_metrics(filename, doContracts, network, wallets:list[int]=None):
-    if network == 'all':
-        networks = ['sepolia', 'polygon']
-    else:
-        networks = [network]
-    
-    if doContracts:
-        addresses = read_yaml(filename)
-        contracts = addresses['contracts']
-        wallets = None
-    else:
-        contracts = None
-        if wallets == None:
-            addresses = read_yaml(filename)
-            wallets = addresses['wallets']
-        
-    # breakpoint()
-        
-    total_metrics = []
-    for network in networks:
-        print(f'Running on network: {network}')
-    
-        bs = create_scanner(network)
-        
-        if wallets == None:
-            wallets = bs.get_wallets(contracts)
-        
-        # breakpoint()
+def select_shard(wallets:list[int], shard:tuple[int,int]=None) -> list[int]:
+    """
+        Deterministic slice of the wallets for shard i of N.
+        The slice depends on the address only, not on the order
+        of the wallets in the file
+    """
+    if shard == None:
+        return wallets
+    index, nr_shards = shard
+    if nr_shards < 1 or not 0 <= index < nr_shards:
+        raise Exception(f'Shard {index} of {nr_shards} is not valid')
+    return [wallet for wallet in wallets if wallet % nr_shards == index]
 
-        balances = bs.get_POL_balance(wallets)
-        for balance in balances:
-            print(f"Account {balance['account']} has {balance['balance']} wei, {int(balance['balance'])/WEI_TO_POL} POL")
-        
-        total_metrics.extend(metrics_per_wallet(wallets, bs))
-        # breakpoint()
 
-        
-    # breakpoint()
-    total_gov_nfts = 0
-    total_bought_nfts = 0
-    total_sold_nfts = 0
-    total_gains = 0
-    total_costs = 0
-    total_addrs = len(wallets)
-    total_sellers = []
-    total_buyers = []
+def aggregate_metrics(total_metrics, total_addrs) -> dict:
+    """
+        Counters, wei sums and seller/buyer sets over all the wallets,
+        everything needed to print the summary or to merge with other shards
+    """
+    summary = {
+        'wallets': total_addrs,
+        'gov_nfts': 0,
+        'bought_nfts': 0,
+        'sold_nfts': 0,
+        'gains': 0,
+        'costs': 0,
+        'sellers': set(),
+        'buyers': set(),
+    }
 
     for addr_metrics in total_metrics:
         # We use variables internal to the loop in case we want to
@@ -109,29 +109,186 @@ def calculate_metrics(filename, doContracts, network, wallets:list[int]=None):
                 addr_costs = addr_costs + nft.get_costs()
                 buyers.extend(nft.get_buyers())
             if not (nft.is_gov() or nft.was_ever_sold() or nft.was_ever_bought() or nft.was_ever_created()):
-                raise Exception(f'NFT {nft.id} has no known status')
+                EVENTS.warning('no_known_status', f'NFT {nft.id} has no known status', nft=nft.id, network=nft.network)
             
-        total_gov_nfts += addr_gov_nfts
-        total_bought_nfts += addr_bought_nfts
-        total_sold_nfts += addr_sold_nfts
-        total_gains += addr_gains
-        total_costs += addr_costs
-        total_sellers.extend(sellers)
-        total_buyers.extend(buyers)
+        summary['gov_nfts'] += addr_gov_nfts
+        summary['bought_nfts'] += addr_bought_nfts
+        summary['sold_nfts'] += addr_sold_nfts
+        summary['gains'] += addr_gains
+        summary['costs'] += addr_costs
+        summary['sellers'].update(sellers)
+        summary['buyers'].update(buyers)
 
-    # breakpoint()
-    total_sellers_nr = len(set(total_sellers))
-    total_buyers_nr = len(set(total_buyers))
+    return summary
+
+
+def merge_summaries(summaries:list[dict]) -> dict:
+    """
+        Combine the summaries of disjoint shards
+    """
+    merged = aggregate_metrics([], 0)
+    for summary in summaries:
+        for key in ['wallets', 'gov_nfts', 'bought_nfts', 'sold_nfts', 'gains', 'costs']:
+            merged[key] += summary[key]
+        merged['sellers'].update(summary['sellers'])
+        merged['buyers'].update(summary['buyers'])
+    return merged
+
+
+def write_partial(filename, summary:dict, shard:tuple[int,int]=None):
+    """
+        Serialize a summary so that it can be merged later,
+        addresses are stored as hex strings
+    """
+    partial = {key: summary[key] for key in ['wallets', 'gov_nfts', 'bought_nfts', 'sold_nfts', 'gains', 'costs']}
+    partial['sellers'] = sorted(Int2HexStr(seller) for seller in summary['sellers'])
+    partial['buyers'] = sorted(Int2HexStr(buyer) for buyer in summary['buyers'])
+    if shard != None:
+        partial['shard'] = f'{shard[0]}/{shard[1]}'
+    write_yaml(filename, partial)
+    EVENTS.info('partial_written', f'Partial result written to {filename}', filename=filename)
+
+
+def read_partial(filename) -> dict:
+    partial = read_yaml(filename)
+    summary = {key: partial[key] for key in ['wallets', 'gov_nfts', 'bought_nfts', 'sold_nfts', 'gains', 'costs']}
+    summary['sellers'] = set(HexStr2Int(seller) for seller in partial['sellers'])
+    summary['buyers'] = set(HexStr2Int(buyer) for buyer in partial['buyers'])
+    summary['shard'] = None
+    if 'shard' in partial:
+        summary['shard'] = tuple(int(part) for part in partial['shard'].split('/'))
+    return summary
+
+
+def check_shards(filenames:list[str], summaries:list[dict]):
+    """
+        Partials can only be merged if they are distinct shards of the same split,
+        otherwise wallets, NFTs and wei would be counted more than once
+    """
+    shards = [summary['shard'] for summary in summaries]
+    if None in shards:
+        if len(shards) > 1:
+            raise Exception(f'Partial {filenames[shards.index(None)]} was not written by a shard, it cannot be merged with others')
+        return
+    nr_shards = set(shard[1] for shard in shards)
+    if len(nr_shards) > 1:
+        raise Exception(f'Partials come from different splits (N in {sorted(nr_shards)})')
+    seen = {}
+    for filename, shard in zip(filenames, shards):
+        if shard in seen:
+            raise Exception(f'Shard {shard[0]}/{shard[1]} is both in {seen[shard]} and {filename}')
+        seen[shard] = filename
+    nr_shards = shards[0][1]
+    missing = [index for index in range(nr_shards) if (index, nr_shards) not in seen]
+    if len(missing) > 0:
+        EVENTS.warning('merge_missing_shards', f'Shards {missing} of {nr_shards} are missing, the summary only covers part of the wallets', missing=missing, nr_shards=nr_shards)
+
+
+def print_summary(summary:dict):
+    total_addrs = summary['wallets']
+    total_gov_nfts = summary['gov_nfts']
+    total_bought_nfts = summary['bought_nfts']
+    total_sold_nfts = summary['sold_nfts']
+    total_gains = summary['gains']
+    total_costs = summary['costs']
+    total_sellers_nr = len(summary['sellers'])
+    total_buyers_nr = len(summary['buyers'])
     print(f'Total wallets: {total_addrs}')
     print(f'Number of sales+purchases: {total_bought_nfts+total_sold_nfts}')
-    print(f'Average governance NFTs: {total_gov_nfts}/{total_addrs} = {total_gov_nfts/total_addrs}')
-    print(f'Average times NFTs are bought: {total_bought_nfts}/{total_addrs} = {total_bought_nfts/total_addrs}')
-    print(f'Average times NFTs are sold: {total_sold_nfts}/{total_addrs} = {total_sold_nfts/total_addrs}')
-    print(f'Percentage sellers with at least one sale: {total_sellers_nr}/{total_addrs} = {make_percentage(total_sellers_nr/total_addrs)}%')
-    print(f'Percentage buyers with at least one purchase: {total_buyers_nr}/{total_addrs} = {make_percentage(total_buyers_nr/total_addrs)}%')
-    print(f'Sold NFTs: average revenues per wallet (POL): {total_gains/WEI_TO_POL}/{total_addrs} = {total_gains/WEI_TO_POL/total_addrs}')
-    print(f'Sold NFTs: average revenues per NFT (POL): {total_gains/WEI_TO_POL}/{total_sold_nfts} = {total_gains/WEI_TO_POL/total_sold_nfts}')
-    print(f'Bought NFTs: average price per wallet (POL): {total_costs/WEI_TO_POL}/{total_addrs} = {total_costs/WEI_TO_POL/total_addrs}')
-    print(f'Bought NFTs: average price per NFT(POL): {total_costs/WEI_TO_POL}/{total_bought_nfts} = {total_costs/WEI_TO_POL/total_bought_nfts}')
-
-    # breakpoint()
\ No newline at end of file
+    print(f'Average governance NFTs: {total_gov_nfts}/{total_addrs} = {ratio(total_gov_nfts, total_addrs)}')
+    print(f'Average times NFTs are bought: {total_bought_nfts}/{total_addrs} = {ratio(total_bought_nfts, total_addrs)}')
+    print(f'Average times NFTs are sold: {total_sold_nfts}/{total_addrs} = {ratio(total_sold_nfts, total_addrs)}')
+    print(f'Percentage sellers with at least one sale: {total_sellers_nr}/{total_addrs} = {make_percentage(ratio(total_sellers_nr, total_addrs))}%')
+    print(f'Percentage buyers with at least one purchase: {total_buyers_nr}/{total_addrs} = {make_percentage(ratio(total_buyers_nr, total_addrs))}%')
+    print(f'Sold NFTs: average revenues per wallet (POL): {total_gains/WEI_TO_POL}/{total_addrs} = {ratio(total_gains/WEI_TO_POL, total_addrs)}')
+    print(f'Sold NFTs: average revenues per NFT (POL): {total_gains/WEI_TO_POL}/{total_sold_nfts} = {ratio(total_gains/WEI_TO_POL, total_sold_nfts)}')
+    print(f'Bought NFTs: average price per wallet (POL): {total_costs/WEI_TO_POL}/{total_addrs} = {ratio(total_costs/WEI_TO_POL, total_addrs)}')
+    print(f'Bought NFTs: average price per NFT(POL): {total_costs/WEI_TO_POL}/{total_bought_nfts} = {ratio(total_costs/WEI_TO_POL, total_bought_nfts)}')
+
+
+def merge_partials(filenames:list[str]):
+    summaries = [read_partial(filename) for filename in filenames]
+    check_shards(filenames, summaries)
+    EVENTS.info('merge', f'Merging {len(summaries)} partial results', filenames=filenames)
+    print_summary(merge_summaries(summaries))
+
+
+def calculate_metrics(filename, doContracts, network, wallets:list[int]=None, shard:tuple[int,int]=None, partial:str=None, settings_file=SETTINGS_FILE, backend:str='account', fromBlock:int=0, toBlock:int=None, plan_only:bool=False, history:str=None, attribution:str='equal', recorded_logs:str=None):
+    if backend not in ['account', 'logs']:
+        raise Exception(f'Backend {backend} not supported')
+    logs = None
+    if recorded_logs != None:
+        # Recorded logs replace the scan of the contracts
+        backend = 'logs'
+        logs = read_recorded_logs(recorded_logs)
+    if attribution not in ATTRIBUTIONS:
+        raise Exception(f'Attribution {attribution} not supported')
+
+    if network == 'all':
+        networks = ['sepolia', 'polygon']
+    else:
+        networks = [network]
+    
+    if doContracts:
+        addresses = read_yaml(filename)
+        contracts = addresses['contracts']
+        wallets = None
+    else:
+        contracts = None
+        if wallets == None or backend == 'logs':
+            addresses = read_yaml(filename)
+        if wallets == None:
+            wallets = addresses['wallets']
+        if backend == 'logs':
+            # The logs are scanned per contract
+            contracts = addresses['contracts']
+        wallets = select_shard(wallets, shard)
+        
+    # breakpoint()
+        
+    total_metrics = []
+    for network in networks:
+        EVENTS.info('network', f'Running on network: {network}', network=network)
+    
+        bs = create_scanner(network, settings_file)
+        
+        if wallets == None:
+            wallets = select_shard(bs.get_wallets(contracts), shard)
+        
+        # breakpoint()
+
+        if backend == 'logs':
+            plan = plan_logs(wallets, contracts, bs, fromBlock, toBlock, logs)
+            for wallet in wallets:
+                balance = plan['balances'].get(wallet, 0)
+                EVENTS.info('balance', f"Account {Int2HexStr(wallet)} has {balance} wei, {balance/WEI_TO_POL} POL", address=Int2HexStr(wallet), balance=balance)
+            if plan_only:
+                continue
+            total_metrics.extend(metrics_from_logs(wallets, contracts, bs, fromBlock, plan['toBlock'], logs=logs, attribution=attribution))
+        else:
+            plan = plan_wallets(wallets, bs)
+            for wallet in wallets:
+                balance = plan['balances'].get(wallet, 0)
+                EVENTS.info('balance', f"Account {Int2HexStr(wallet)} has {balance} wei, {balance/WEI_TO_POL} POL", address=Int2HexStr(wallet), balance=balance)
+            if plan_only:
+                continue
+            total_metrics.extend(metrics_per_wallet(plan['wallets'], bs, plan['estimates'], attribution))
+        # breakpoint()
+
+        
+    if plan_only:
+        return
+
+    if history != None:
+        write_history(history, total_metrics)
+
+    # breakpoint()
+    summary = aggregate_metrics(total_metrics, len(wallets))
+    EVENTS.print_counts(NFT.ANOMALIES + ['no_known_status'])
+
+    if partial != None:
+        write_partial(partial, summary, shard)
+
+    print_summary(summary)
+
+    # breakpoint()
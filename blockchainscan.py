@@ -1,7 +1,8 @@
 import requests
 import time
 
-from .utils import Int2HexStr, HexStr2Int, print_error
+from .utils import Int2HexStr, HexStr2Int
+from .events import EVENTS
 
 # SEP_MAX_RATE = 'Max calls per sec rate limit reached (5/sec)'
 SEP_MAX_RATE_MSG = 'Max calls'
@@ -9,8 +10,14 @@ POL_MAX_RATE_MSG = 'Max rate'
 
 class BlockChainScan:
     SAFETY = 50
+    # Results per page for paginated calls
+    PAGE_SIZE = 100
+    # Max addresses in a balancemulti call
+    BALANCEMULTI_MAX = 20
+    # Max results reachable by paginating a single query
+    RESULT_WINDOW = 10000
 
-    def __init__(self, network:str, endpoint:str, token:str, calls_sec:int):
+    def __init__(self, network:str, endpoint:str, token:str, calls_sec:int, calls_day:int=None):
         # We also store the name of the network
         self.network = network
         # Parameters for http calls
@@ -19,6 +26,8 @@ class BlockChainScan:
         
         # Parameters for call throttling
         self.calls_sec = calls_sec
+        # Daily quota of the API token, if known
+        self.calls_day = calls_day
         self.count = 0
         
         # Initialise time stamps
@@ -45,7 +54,7 @@ class BlockChainScan:
             
             if sleep_ms > 0:
                 # We need to wait
-                print(f'Sleeping {sleep_ms} ms')
+                EVENTS.debug('throttle_sleep', f'Sleeping {sleep_ms} ms', network=self.network, sleep_ms=sleep_ms)
                 time.sleep((sleep_ms+self.SAFETY)/1000)
                 # Update time of action since we slept
                 self.time_stamps[self.count] = time.time_ns() // 1_000_000
@@ -56,9 +65,12 @@ class BlockChainScan:
         self.count = wnd_start
 
     
-    def make_call(self, api_url, paginated=False, attempt=0):
+    def make_call(self, api_url, paginated=False, attempt=0, startblock:int=0, endblock:int=99999999):
         """
-            Generic wrapper for HTTP calls
+            Generic wrapper for HTTP calls. Paginated calls add the block
+            range as startblock/endblock, unless they are None (e.g. getLogs
+            which has its own fromBlock/toBlock). They stop at RESULT_WINDOW
+            results, the pages past it cannot be retrieved
         """
         if attempt > 5:
             raise Exception(f'{api_url} timed out ({attempt} times)')
@@ -67,13 +79,19 @@ class BlockChainScan:
         result = None
         results = []
         page = 1
-        offset = 100
-        startblock=0
-        endblock=99999999
+        offset = self.PAGE_SIZE
         while True:
+            if paginated and page * offset > self.RESULT_WINDOW:
+                # The next page is out of reach, the caller can continue from the last block returned
+                EVENTS.info('result_window', f'Stopping {api_url} at the result window of {len(results)} results', network=self.network, count=len(results))
+                return results
             if paginated:
                 # We are making a call to a paginated endpoint
-                api_url_page = f'{api_url}&page={page}&offset={offset}&startblock={startblock}&endblock={endblock}'
+                api_url_page = f'{api_url}&page={page}&offset={offset}'
+                if startblock != None:
+                    api_url_page = f'{api_url_page}&startblock={startblock}'
+                if endblock != None:
+                    api_url_page = f'{api_url_page}&endblock={endblock}'
             else:
                 api_url_page = api_url
             try:
@@ -84,32 +102,32 @@ class BlockChainScan:
                     payload = response.json()
                     if 'message' in payload and payload['message'] != 'OK':
                         # breakpoint()
-                        if payload['message'] == 'No transactions found':
+                        if payload['message'] in ['No transactions found', 'No records found']:
                             # no problem
                             result = []
                         elif POL_MAX_RATE_MSG in payload['result'] or SEP_MAX_RATE_MSG in payload['result']:
-                            print(f'(Should not happen) sleeping {self.SAFETY} ms')
+                            EVENTS.warning('rate_limited', f'(Should not happen) sleeping {self.SAFETY} ms', network=self.network, sleep_ms=self.SAFETY)
                             # breakpoint()
                             throttled = True
                             time.sleep((self.SAFETY)/1000)
                         else:
-                            print_error(f'Url {api_url_page} gave response {payload}')
+                            EVENTS.error('http_error', f'Url {api_url_page} gave response {payload}', network=self.network, response=payload)
                             # breakpoint()
                             return None
                     else:
                         if 'result' in payload:
                             result = payload['result']
                         elif 'error' in payload:
-                            print_error(f"Url {api_url_page} gave error {payload['error']}")
+                            EVENTS.error('http_error', f"Url {api_url_page} gave error {payload['error']}", network=self.network, response=payload)
                             return None
                         else:
                             raise Exception(f"Url {api_url_page} gave unknown answer {payload}")
                 else:
-                    print_error(f'Url {api_url_page} gave response {response.status_code}, {response}')
+                    EVENTS.error('http_error', f'Url {api_url_page} gave response {response.status_code}, {response}', network=self.network, status_code=response.status_code)
                     return None
             except requests.Timeout:
                 # We retry increasing the attempt number
-                print(f'Retrying call {api_url_page}, attempt {attempt+1}')
+                EVENTS.warning('http_retry', f'Retrying call {api_url_page}, attempt {attempt+1}', network=self.network, attempt=attempt+1)
                 return self.make_call(api_url=api_url_page, attempt=attempt+1)
             except requests.exceptions.RequestException as e:
                 # This should catch all other requests exceptions
@@ -193,6 +211,19 @@ class BlockChainScan:
 
         return result
 
+    def get_block_number(self):
+        """
+           https://docs.polygonscan.com/api-endpoints/geth-parity-proxy#eth_blocknumber
+        """
+        module = 'proxy'
+        action = 'eth_blockNumber'
+
+        api_url = f'{self.endpoint}&module={module}&action={action}&apikey={self.token}'
+        result = self.make_call(api_url=api_url, paginated=False)
+        if result == None:
+            return None
+        return HexStr2Int(result)
+
     def get_transaction(self, txhash):
         """
            https://docs.polygonscan.com/api-endpoints/geth-parity-proxy#eth_gettransactionbyhash 
@@ -205,37 +236,33 @@ class BlockChainScan:
         # breakpoint()
         return result
 
-    def get_normal_transactions(self, address:int):
+    def get_normal_transactions(self, address:int, startblock:int=0, endblock:int=99999999):
         """
             https://docs.polygonscan.com/amoy-polygonscan/api-endpoints/accounts#get-a-list-of-normal-transactions-by-address
         """
         module = 'account'
         action = 'txlist'
         sort = 'asc'
-        startblock = 0
-        endblock = 'latest'
-        api_url = f'{self.endpoint}&module={module}&action={action}&address={Int2HexStr(address)}&sort={sort}&startblock={startblock}&endblock={endblock}&apikey={self.token}'
+        api_url = f'{self.endpoint}&module={module}&action={action}&address={Int2HexStr(address)}&sort={sort}&apikey={self.token}'
 
-        results = self.make_call(api_url=api_url, paginated=True)
+        results = self.make_call(api_url=api_url, paginated=True, startblock=startblock, endblock=endblock)
 
         return results
 
-    def get_internal_transactions(self, address:int):
+    def get_internal_transactions(self, address:int, startblock:int=0, endblock:int=99999999):
         """
             https://docs.polygonscan.com/amoy-polygonscan/api-endpoints/accounts#get-a-list-of-internal-transactions-by-address
         """
         module = 'account'
         action = 'txlistinternal'
         sort = 'asc'
-        startblock = 0
-        endblock = 'latest'
-        api_url = f'{self.endpoint}&module={module}&action={action}&address={Int2HexStr(address)}&sort={sort}&startblock={startblock}&endblock={endblock}&apikey={self.token}'
+        api_url = f'{self.endpoint}&module={module}&action={action}&address={Int2HexStr(address)}&sort={sort}&apikey={self.token}'
 
-        results = self.make_call(api_url=api_url, paginated=True)
+        results = self.make_call(api_url=api_url, paginated=True, startblock=startblock, endblock=endblock)
 
         return results
 
-    def get_ERC_token_transfers(self, action:str, address:int, contract_address:int):
+    def get_ERC_token_transfers(self, action:str, address:int, contract_address:int, startblock:int=0, endblock:int=99999999):
         module = 'account'
         action = action
         sort = 'asc'
@@ -249,27 +276,50 @@ class BlockChainScan:
         if contract_address is not None:
             api_url = f'{api_url}&contractaddress={Int2HexStr(contract_address)}'
         
-        results = self.make_call(api_url=api_url,  paginated=True)
+        results = self.make_call(api_url=api_url,  paginated=True, startblock=startblock, endblock=endblock)
 
         return results
     
-    def get_ERC20_token_transfers(self, address:int, contract_address:int):
+    def has_ERC_token_transfers(self, action:str, address:int):
+        """
+            Probe with a single row whether an address has any token transfer, in or out
+        """
+        module = 'account'
+        api_url = f'{self.endpoint}&module={module}&action={action}&address={Int2HexStr(address)}&page=1&offset=1&sort=asc&apikey={self.token}'
+        result = self.make_call(api_url=api_url, paginated=False)
+        if result == None:
+            return None
+        return len(result) > 0
+
+    def get_ERC20_token_transfers(self, address:int, contract_address:int, startblock:int=0, endblock:int=99999999):
         """
             https://docs.polygonscan.com/amoy-polygonscan/api-endpoints/accounts#get-a-list-of-erc-20-token-transfer-events-by-address
         """
-        return self.get_ERC_token_transfers(action = 'tokentx', address=address, contract_address=contract_address)
+        return self.get_ERC_token_transfers(action = 'tokentx', address=address, contract_address=contract_address, startblock=startblock, endblock=endblock)
 
-    def get_ERC721_token_transfers(self, address:int, contract_address:int):
+    def get_ERC721_token_transfers(self, address:int, contract_address:int, startblock:int=0, endblock:int=99999999):
         """
             https://docs.polygonscan.com/amoy-polygonscan/api-endpoints/accounts#get-a-list-of-erc-721-token-transfer-events-by-address
         """
-        return self.get_ERC_token_transfers(action = 'tokennfttx', address=address, contract_address=contract_address)
+        return self.get_ERC_token_transfers(action = 'tokennfttx', address=address, contract_address=contract_address, startblock=startblock, endblock=endblock)
 
-    def get_ERC1155_token_transfers(self, address:int, contract_address:int):
+    def get_ERC1155_token_transfers(self, address:int, contract_address:int, startblock:int=0, endblock:int=99999999):
         """
             https://docs.polygonscan.com/api-endpoints/accounts#get-a-list-of-erc1155-token-transfer-events-by-address
         """
-        return self.get_ERC_token_transfers(action = 'token1155tx', address=address, contract_address=contract_address)
+        return self.get_ERC_token_transfers(action = 'token1155tx', address=address, contract_address=contract_address, startblock=startblock, endblock=endblock)
+
+    def get_logs(self, contract_address:int, fromBlock:int, toBlock:int):
+        """
+            https://docs.polygonscan.com/api-endpoints/logs#get-event-logs-by-address
+        """
+        module = 'logs'
+        action = 'getLogs'
+        api_url = f'{self.endpoint}&module={module}&action={action}&address={Int2HexStr(contract_address)}&fromBlock={fromBlock}&toBlock={toBlock}&apikey={self.token}'
+
+        results = self.make_call(api_url=api_url, paginated=True, startblock=None, endblock=None)
+
+        return results
 
     def get_ERC20_token_supply(self, contract_address:int):
         """
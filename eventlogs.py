@@ -0,0 +1,226 @@
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from .blockchainscan import BlockChainScan
+from .addresstransactions import AddressTransactions, TRANS_CACHE, cache_transactions
+from .utils import Int2HexStr, HexStr2Int, check_dict
+from .nft import NFT
+from .events import EVENTS
+
+# keccak256 of the event signatures, i.e. topic0 of the logs
+# Transfer(address,address,uint256)
+TRANSFER_TOPIC = HexStr2Int('0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef')
+# TransferSingle(address,address,address,uint256,uint256)
+TRANSFER_SINGLE_TOPIC = HexStr2Int('0xc3d58168c5ae7397731d063d5bbf3d657854427343f4c083240f7aacaa2d0f62')
+# TransferBatch(address,address,address,uint256[],uint256[])
+TRANSFER_BATCH_TOPIC = HexStr2Int('0x4a39dc06d4c0dbc64b70af90fd698a233a518aa5d07e595d983b8c0526c8f7fb')
+
+# Number of hex characters in a 32 bytes ABI word
+WORD_LEN = 64
+ADDRESS_LEN = 40
+# Logs do not carry the token name, which NFT uses to spot governance NFTs
+TOKEN_NAMES = {HexStr2Int(NFT.GOV_CONTRACT): NFT.GOV_NFT}
+BLOCK_STEP = 100_000
+
+
+def split_words(data:str) -> list[int]:
+    """
+        Split ABI encoded data into its 32 bytes words
+    """
+    if data.lower().startswith('0x'):
+        data = data[2:]
+    return [int(data[i:i+WORD_LEN], 16) for i in range(0, len(data), WORD_LEN)]
+
+def decode_uint_array(words:list[int], offset:int) -> list[int]:
+    """
+        Decode a dynamic uint256[] whose position (in bytes) is given by offset
+    """
+    start = offset // 32
+    length = words[start]
+    return words[start+1:start+1+length]
+
+def topic_address(topic:str) -> int:
+    # Addresses are left padded to 32 bytes in the topics
+    return HexStr2Int(topic) & ((1 << 160) - 1)
+
+def make_transfer(log:dict, tr_from:int, tr_to:int, tokenID:int, tokenValue:int, token_names:dict) -> dict:
+    """
+        Build a transfer with the same fields as returned by
+        tokennfttx / token1155tx, so that it can be handled by
+        AddressTransactions.parse_token_transfers
+    """
+    contractAddress = HexStr2Int(log['address'])
+    return {
+        'blockNumber': f"{HexStr2Int(log['blockNumber'])}",
+        'timeStamp': f"{HexStr2Int(log['timeStamp'])}",
+        'hash': log['transactionHash'],
+        'from': Int2HexStr(tr_from, ADDRESS_LEN),
+        'to': Int2HexStr(tr_to, ADDRESS_LEN),
+        'contractAddress': Int2HexStr(contractAddress, ADDRESS_LEN),
+        'tokenID': f'{tokenID}',
+        'tokenValue': f'{tokenValue}',
+        'tokenName': token_names.get(contractAddress, ''),
+    }
+
+def decode_transfer_logs(logs:list[dict], token_names:dict=TOKEN_NAMES):
+    """
+        Decode Transfer (ERC721), TransferSingle and TransferBatch (ERC1155) logs,
+        returns the ERC721 and the ERC1155 transfers sorted by block and log index.
+        TransferBatch logs are expanded in one transfer per token.
+        Other logs (e.g. approvals, ERC20 transfers) are ignored
+    """
+    erc721 = []
+    erc1155 = []
+    for log in logs:
+        check_dict(log)
+        topics = log['topics']
+        if len(topics) == 0:
+            continue
+        order = (HexStr2Int(log['blockNumber']), HexStr2Int(log['logIndex']))
+        topic0 = HexStr2Int(topics[0])
+        if topic0 == TRANSFER_TOPIC:
+            if len(topics) != 4:
+                # ERC20 transfer, the amount is not indexed
+                continue
+            tr = make_transfer(log, topic_address(topics[1]), topic_address(topics[2]), HexStr2Int(topics[3]), 1, token_names)
+            erc721.append((order, 0, tr))
+        elif topic0 == TRANSFER_SINGLE_TOPIC:
+            tokenID, tokenValue = split_words(log['data'])[:2]
+            tr = make_transfer(log, topic_address(topics[2]), topic_address(topics[3]), tokenID, tokenValue, token_names)
+            erc1155.append((order, 0, tr))
+        elif topic0 == TRANSFER_BATCH_TOPIC:
+            words = split_words(log['data'])
+            tokenIDs = decode_uint_array(words, words[0])
+            tokenValues = decode_uint_array(words, words[1])
+            if len(tokenIDs) != len(tokenValues):
+                raise Exception(f"TransferBatch in {log['transactionHash']} has {len(tokenIDs)} ids but {len(tokenValues)} values")
+            for i in range(len(tokenIDs)):
+                tr = make_transfer(log, topic_address(topics[2]), topic_address(topics[3]), tokenIDs[i], tokenValues[i], token_names)
+                erc1155.append((order, i, tr))
+
+    erc721.sort(key=lambda item: item[:2])
+    erc1155.sort(key=lambda item: item[:2])
+    return [item[2] for item in erc721], [item[2] for item in erc1155]
+
+def fetch_split(fetch, fromBlock:int, toBlock:int, window:int, label:str) -> list[dict]:
+    """
+        Results of fetch(fromBlock, toBlock), sorted by block. If the call fails
+        the range is split in half. If it stops at the result window, the rows of
+        its last block may be incomplete: they are dropped and the fetch continues
+        from that block, so the rows already paid for are kept
+    """
+    result = fetch(fromBlock, toBlock)
+    if result == None:
+        if fromBlock == toBlock:
+            raise Exception(f'Could not retrieve {label} in block {fromBlock}')
+        middle = (fromBlock + toBlock) // 2
+        EVENTS.debug('range_split', f'Splitting blocks {fromBlock}-{toBlock} of {label} at {middle}', label=label, fromBlock=fromBlock, toBlock=toBlock)
+        return fetch_split(fetch, fromBlock, middle, window, label) + fetch_split(fetch, middle + 1, toBlock, window, label)
+    if len(result) < window:
+        return result
+    # Block numbers are hex in logs and decimal in the account lists
+    last_block = int(result[-1]['blockNumber'], 0)
+    if last_block == fromBlock:
+        raise Exception(f'More than {window} {label} in block {fromBlock}')
+    EVENTS.debug('range_continue', f'Continuing {label} from block {last_block}', label=label, fromBlock=last_block, toBlock=toBlock)
+    kept = [row for row in result if int(row['blockNumber'], 0) < last_block]
+    return kept + fetch_split(fetch, last_block, toBlock, window, label)
+
+def fetch_range_logs(bs:BlockChainScan, contract:int, fromBlock:int, toBlock:int) -> list[dict]:
+    return fetch_split(lambda start, end: bs.get_logs(contract, start, end), fromBlock, toBlock, bs.RESULT_WINDOW, f'logs of {Int2HexStr(contract)}')
+
+def fetch_transfer_logs(bs:BlockChainScan, contracts:list[int], fromBlock:int, toBlock:int, block_step:int=BLOCK_STEP) -> list[dict]:
+    """
+        Retrieve all the logs of the contracts over the block range,
+        in steps of block_step blocks to keep each scan within the API limits
+    """
+    logs = []
+    for contract in contracts:
+        start = fromBlock
+        while start <= toBlock:
+            end = min(start + block_step - 1, toBlock)
+            logs.extend(fetch_range_logs(bs, contract, start, end))
+            start = end + 1
+    EVENTS.info('logs', f'{len(logs)} logs for {len(contracts)} contracts in blocks {fromBlock}-{toBlock}', count=len(logs), fromBlock=fromBlock, toBlock=toBlock)
+    return logs
+
+def prefill_transactions(bs:BlockChainScan, contracts:list[int], fromBlock:int, toBlock:int):
+    """
+        Logs do not carry the value of their transaction. The transactions sent
+        to the contracts (e.g. mints and direct sales) are retrieved in bulk,
+        the others will need one eth_getTransactionByHash call each
+    """
+    for contract in contracts:
+        try:
+            transactions = fetch_split(lambda start, end: bs.get_normal_transactions(contract, startblock=start, endblock=end), fromBlock, toBlock, bs.RESULT_WINDOW, f'transactions of {Int2HexStr(contract)}')
+        except Exception as e:
+            EVENTS.warning('prefill_failed', f'Could not retrieve the transactions of {Int2HexStr(contract)}: {e}', contract=Int2HexStr(contract), error=f'{e}')
+            continue
+        cache_transactions(transactions)
+
+def count_lookups(transfers:list[dict], wallets:list[int]) -> int:
+    """
+        Transactions of the tracked wallets that are not cached and
+        will be retrieved by hash, one call each
+    """
+    wallets = set(wallets)
+    missing = set()
+    for tr in transfers:
+        if HexStr2Int(tr['from']) in wallets or HexStr2Int(tr['to']) in wallets:
+            txhash = HexStr2Int(tr['hash'])
+            if Int2HexStr(txhash) not in TRANS_CACHE:
+                missing.add(txhash)
+    return len(missing)
+
+def read_recorded_logs(filename) -> list[dict]:
+    """
+        Logs recorded as returned by getLogs (a JSON list)
+    """
+    full_file_path = Path(__file__).parent.joinpath(filename)
+    with open(full_file_path) as recorded:
+        return json.load(recorded)
+
+def split_per_wallet(transfers:list[dict], wallets:list[int]) -> dict:
+    """
+        Group the transfers by the tracked wallet they involve
+    """
+    per_wallet = {wallet: [] for wallet in wallets}
+    for tr in transfers:
+        for adrs in {HexStr2Int(tr['from']), HexStr2Int(tr['to'])}:
+            if adrs in per_wallet:
+                per_wallet[adrs].append(tr)
+    return per_wallet
+
+def parse_decoded_transfers(addr_metrics_list:list[AddressTransactions], erc721:list[dict], erc1155:list[dict]):
+    """
+        Hand the decoded transfers to the AddressTransactions of the wallets involved
+    """
+    wallets = [addr_metrics.address for addr_metrics in addr_metrics_list]
+    erc721_per_wallet = split_per_wallet(erc721, wallets)
+    erc1155_per_wallet = split_per_wallet(erc1155, wallets)
+    for addr_metrics in addr_metrics_list:
+        addr_metrics.parse_token_transfers({'ERC1155': erc1155_per_wallet[addr_metrics.address], 'ERC721': erc721_per_wallet[addr_metrics.address]})
+
+def metrics_from_logs(wallets:list[int], contracts:list[int], bs:BlockChainScan, fromBlock:int=0, toBlock:int=None, logs:list[dict]=None, attribution:str='equal') -> list[AddressTransactions]:
+    """
+        Same as metrics_per_wallet but with a single scan of the contract logs
+        instead of per address calls. Recorded logs (see read_recorded_logs)
+        can be given instead of querying the API
+    """
+    if logs == None:
+        if toBlock == None:
+            toBlock = bs.get_block_number()
+            if toBlock == None:
+                raise Exception(f'Could not retrieve the last block on {bs.network}')
+        logs = fetch_transfer_logs(bs, contracts, fromBlock, toBlock)
+        prefill_transactions(bs, contracts, fromBlock, toBlock)
+
+    erc721, erc1155 = decode_transfer_logs(logs)
+    EVENTS.info('logs_decoded', f'{len(erc721)} ERC721 and {len(erc1155)} ERC1155 token transfers decoded', erc721=len(erc721), erc1155=len(erc1155))
+    lookups = count_lookups(erc721 + erc1155, wallets)
+    EVENTS.info('logs_lookups', f'{lookups} transactions to retrieve by hash, ETA {timedelta(seconds=int(lookups / bs.calls_sec))} at {bs.calls_sec} calls/sec', lookups=lookups)
+
+    total_metrics = [AddressTransactions(wallet, bs, attribution) for wallet in wallets]
+    parse_decoded_transfers(total_metrics, erc721, erc1155)
+    return total_metrics
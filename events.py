@@ -0,0 +1,104 @@
+import atexit
+import json
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+# Console level at which nothing is printed
+QUIET = 100
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+
+
+class EventSink:
+    """
+        Structured events with a level and a kind. Every event is counted per kind,
+        printed if its level reaches console_level and, once a file is opened,
+        written as a JSON line by a background thread so that the caller does not
+        wait on the disk
+    """
+    # Events written at once by the background thread
+    BATCH = 1000
+
+    def __init__(self, console_level:int=INFO):
+        self.console_level = console_level
+        self.counts = {}
+        self.queue = None
+        self.writer = None
+
+    @property
+    def quiet(self) -> bool:
+        return self.console_level >= QUIET
+
+    def set_quiet(self):
+        self.console_level = QUIET
+
+    def open(self, filename):
+        if self.queue != None:
+            raise Exception('Events file already opened')
+        full_file_path = Path(__file__).parent.joinpath(filename)
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write_events, args=(full_file_path,), daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def write_events(self, full_file_path):
+        with open(full_file_path, 'a') as out:
+            while True:
+                event = self.queue.get()
+                lines = []
+                # Write what accumulated in one go
+                while event != None:
+                    lines.append(json.dumps(event, default=str))
+                    if len(lines) >= self.BATCH or self.queue.empty():
+                        break
+                    event = self.queue.get()
+                if len(lines) > 0:
+                    out.write('\n'.join(lines) + '\n')
+                    out.flush()
+                if event == None:
+                    return
+
+    def close(self):
+        if self.queue == None:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.queue = None
+        self.writer = None
+
+    def emit(self, level:int, kind:str, message:str, **fields):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if level >= self.console_level:
+            if level >= ERROR:
+                print('ERROR!!')
+            print(message)
+        if self.queue != None:
+            event = {'time': datetime.now().isoformat(), 'level': LEVEL_NAMES[level], 'kind': kind, 'message': message}
+            event.update(fields)
+            self.queue.put(event)
+
+    def debug(self, kind:str, message:str, **fields):
+        self.emit(DEBUG, kind, message, **fields)
+
+    def info(self, kind:str, message:str, **fields):
+        self.emit(INFO, kind, message, **fields)
+
+    def warning(self, kind:str, message:str, **fields):
+        self.emit(WARNING, kind, message, **fields)
+
+    def error(self, kind:str, message:str, **fields):
+        self.emit(ERROR, kind, message, **fields)
+
+    def print_counts(self, kinds:list[str]):
+        counts = [f'{kind}: {self.counts[kind]}' for kind in kinds if kind in self.counts]
+        if len(counts) > 0:
+            self.info('event_counts', f"Anomalies: {', '.join(counts)}", counts={kind: self.counts[kind] for kind in kinds if kind in self.counts})
+
+
+# Sink shared by all the modules
+EVENTS = EventSink()
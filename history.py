@@ -0,0 +1,52 @@
+import csv
+from datetime import datetime
+from pathlib import Path
+
+from .utils import Int2HexStr, HexStr2Int
+from .events import EVENTS
+
+FIELDS = ['network', 'wallet', 'nft', 'date', 'from', 'to', 'value', 'status']
+
+
+def write_history(filename, total_metrics):
+    """
+        Store the transfers of the NFTs of each wallet with their status,
+        so that reports can be built without fetching again
+    """
+    full_file_path = Path(__file__).parent.joinpath(filename)
+    nr_rows = 0
+    with open(full_file_path, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(FIELDS)
+        for addr_metrics in total_metrics:
+            for nft in addr_metrics.NFTs:
+                for i in range(len(nft.statuses)):
+                    writer.writerow([
+                        nft.network,
+                        Int2HexStr(addr_metrics.address),
+                        nft.id,
+                        nft.dates[i].isoformat(),
+                        Int2HexStr(nft.froms[i]),
+                        Int2HexStr(nft.tos[i]),
+                        nft.values[i],
+                        nft.statuses[i],
+                    ])
+                    nr_rows += 1
+    EVENTS.info('history_written', f'History of {nr_rows} transfers written to {filename}', filename=filename, count=nr_rows)
+
+
+def read_history(filename):
+    """
+        Generator over the stored transfers, one at a time to keep
+        the memory low on large histories
+    """
+    full_file_path = Path(__file__).parent.joinpath(filename)
+    with open(full_file_path, newline='') as history:
+        reader = csv.DictReader(history)
+        for row in reader:
+            row['wallet'] = HexStr2Int(row['wallet'])
+            row['date'] = datetime.fromisoformat(row['date'])
+            row['from'] = HexStr2Int(row['from'])
+            row['to'] = HexStr2Int(row['to'])
+            row['value'] = int(row['value'])
+            yield row
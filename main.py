@@ -1,4 +1,7 @@
-from .blockchain_metrics import calculate_metrics
+from .blockchain_metrics import calculate_metrics, merge_partials
+from .watch import watch_metrics, DEFAULT_INTERVAL, DEFAULT_PORT, DEFAULT_LAG
+from .events import EVENTS
+from .addresstransactions import ATTRIBUTIONS
 
 if __name__ == "__main__":
     import argparse
@@ -21,8 +24,8 @@ if __name__ == "__main__":
         '-n', '--network',
         dest='network',
         action='store',
-        required=True,
-        default='all',
+        required=False,
+        default=None,
         help='specifies the name of the network to use (all/polygon/sepolia)',
     )
 
@@ -34,6 +37,193 @@ if __name__ == "__main__":
         default=False,
         help='specifies whether to start from contracts (or from wallet addresses)',
     )
+
+    parser.add_argument(
+        '-s', '--shard',
+        dest='shard',
+        action='store',
+        required=False,
+        default=None,
+        help='specifies the slice of wallets to process as i/N (shard i of N, 0 <= i < N)',
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        dest='partial',
+        action='store',
+        required=False,
+        default=None,
+        help='specifies the file where to write the partial result (default partial_<i>_of_<N>.yaml when sharding)',
+    )
+
+    parser.add_argument(
+        '-k', '--settings',
+        dest='settings',
+        action='store',
+        required=False,
+        default='.settings.yaml',
+        help='specifies the settings file with the API tokens, e.g. a different key per shard',
+    )
+
+    parser.add_argument(
+        '-b', '--backend',
+        dest='backend',
+        action='store',
+        required=False,
+        default='account',
+        help='specifies how transfers are retrieved: per address (account) or scanning the logs of the contracts (logs)',
+    )
+
+    parser.add_argument(
+        '--from-block',
+        dest='fromBlock',
+        action='store',
+        type=int,
+        required=False,
+        default=0,
+        help='specifies the first block to scan with the logs backend',
+    )
+
+    parser.add_argument(
+        '--to-block',
+        dest='toBlock',
+        action='store',
+        type=int,
+        required=False,
+        default=None,
+        help='specifies the last block to scan with the logs backend (default latest)',
+    )
+
+    parser.add_argument(
+        '-p', '--plan',
+        dest='plan_only',
+        action='store_true',
+        required=False,
+        default=False,
+        help='only estimates the calls needed and the duration of the run, without fetching the wallets',
+    )
+
+    parser.add_argument(
+        '-w', '--watch',
+        dest='watch',
+        action='store_true',
+        required=False,
+        default=False,
+        help='keeps running, fetching new blocks and serving the metrics as JSON over HTTP',
+    )
+
+    parser.add_argument(
+        '-i', '--interval',
+        dest='interval',
+        action='store',
+        type=int,
+        required=False,
+        default=DEFAULT_INTERVAL,
+        help='specifies the seconds between polls for new blocks in watch mode',
+    )
+
+    parser.add_argument(
+        '--lag',
+        dest='lag',
+        action='store',
+        type=int,
+        required=False,
+        default=DEFAULT_LAG,
+        help='specifies how many blocks behind the head watch mode stops, as the explorer indexes lag behind the chain',
+    )
+
+    parser.add_argument(
+        '--port',
+        dest='port',
+        action='store',
+        type=int,
+        required=False,
+        default=DEFAULT_PORT,
+        help='specifies the local port serving the metrics in watch mode',
+    )
+
+    parser.add_argument(
+        '--store',
+        dest='history',
+        action='store',
+        required=False,
+        default=None,
+        help='specifies the file where to store the history of the transfers, to build reports later',
+    )
+
+    parser.add_argument(
+        '-r', '--report',
+        dest='report',
+        action='store',
+        nargs='+',
+        required=False,
+        default=None,
+        help='builds an HTML report from the given stored histories',
+    )
+
+    parser.add_argument(
+        '--bucket',
+        dest='bucket',
+        action='store',
+        required=False,
+        default='day',
+        help='specifies the time bucket of the report (day/week/month)',
+    )
+
+    parser.add_argument(
+        '--html',
+        dest='html',
+        action='store',
+        required=False,
+        default='report.html',
+        help='specifies the file where to write the report',
+    )
+
+    parser.add_argument(
+        '-q', '--quiet',
+        dest='quiet',
+        action='store_true',
+        required=False,
+        default=False,
+        help='only prints the final summary',
+    )
+
+    parser.add_argument(
+        '-e', '--events',
+        dest='events',
+        action='store',
+        required=False,
+        default=None,
+        help='specifies a JSONL file where to append all the events of the run (calls, throttling, anomalies)',
+    )
+
+    parser.add_argument(
+        '-a', '--attribution',
+        dest='attribution',
+        action='store',
+        required=False,
+        default='equal',
+        help='specifies how the value of a transaction is split across the tokens it moves (equal/units/full)',
+    )
+
+    parser.add_argument(
+        '--recorded-logs',
+        dest='recorded_logs',
+        action='store',
+        required=False,
+        default=None,
+        help='specifies a JSON file of logs recorded from getLogs, used instead of scanning the contracts (implies -b logs)',
+    )
+
+    parser.add_argument(
+        '-m', '--merge',
+        dest='merge',
+        action='store',
+        nargs='+',
+        required=False,
+        default=None,
+        help='merges the given partial result files and prints the summary',
+    )
     args, unknown = parser.parse_known_args()
 
     if len(unknown) > 0:
@@ -41,9 +231,60 @@ if __name__ == "__main__":
         parser.print_help()
         exit(-1)
 
+    if args.quiet:
+        EVENTS.set_quiet()
+    if args.events != None:
+        EVENTS.open(args.events)
+
+    if args.merge != None:
+        merge_partials(args.merge)
+        exit(0)
+
+    if args.report != None:
+        # plotly is only needed for reports
+        from .report import build_report, BUCKETS
+        if args.bucket not in BUCKETS:
+            print(f'Bucket not supported: {args.bucket}')
+            parser.print_help()
+            exit(-1)
+        build_report(args.report, output=args.html, bucket=args.bucket)
+        exit(0)
+
+    if args.network == None:
+        print('Network is required')
+        parser.print_help()
+        exit(-1)
+
     if args.network not in ['polygon', 'sepolia', 'all']:
         print(f'Network not supported: {args.network}')
         parser.print_help()
         exit(-1)
 
-    calculate_metrics(filename=args.filename, doContracts=args.doContracts, network=args.network)
+    if args.backend not in ['account', 'logs']:
+        print(f'Backend not supported: {args.backend}')
+        parser.print_help()
+        exit(-1)
+
+    if args.attribution not in ATTRIBUTIONS:
+        print(f'Attribution not supported: {args.attribution}')
+        parser.print_help()
+        exit(-1)
+
+    shard = None
+    if args.shard != None:
+        try:
+            shard = tuple(int(part) for part in args.shard.split('/'))
+        except ValueError:
+            shard = None
+        if shard == None or len(shard) != 2 or shard[1] < 1 or not 0 <= shard[0] < shard[1]:
+            print(f'Shard not valid: {args.shard}')
+            parser.print_help()
+            exit(-1)
+        if args.partial == None:
+            args.partial = f'partial_{shard[0]}_of_{shard[1]}.yaml'
+
+    if args.watch:
+        watch_metrics(filename=args.filename, doContracts=args.doContracts, network=args.network, interval=args.interval, port=args.port, settings_file=args.settings, backend=args.backend, fromBlock=args.fromBlock, shard=shard, attribution=args.attribution, lag=args.lag)
+        exit(0)
+
+    calculate_metrics(filename=args.filename, doContracts=args.doContracts, network=args.network, shard=shard, partial=args.partial, settings_file=args.settings, backend=args.backend, fromBlock=args.fromBlock, toBlock=args.toBlock, plan_only=args.plan_only, history=args.history, attribution=args.attribution, recorded_logs=args.recorded_logs)
@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from .utils import Int2HexStr, HexStr2Int, print_error, check_dict
+from .utils import Int2HexStr, HexStr2Int, check_dict
+from .events import EVENTS
 
 class NFT:
     GOV_NFT = 'NftGovernance'
@@ -10,12 +11,28 @@ class NFT:
     SOLD = 'sold'
     BOUGHT = 'bought'
     GOV = 'governance'
+    ANOMALY = 'anomaly'
+    # Kinds of events recorded by set_anomaly (and self transfers)
+    ANOMALIES = ['self_transfer', 'unknown_address', 'incompatible_status', 'created_with_value', 'zero_value_sale', 'zero_value_purchase']
 
     @classmethod
     def gen_key(cls, id, contractAddress):
         return f'{id}_{contractAddress}'
         # return id
     
+    @classmethod
+    def get_value(cls, transaction:dict) -> int:
+        """
+            Value of a transaction, either cached from the transactions
+            of an address (int) or retrieved by hash (hex string)
+        """
+        if type(transaction['value']) == int:
+            return transaction['value']
+        elif transaction['value'].lower().startswith('0x'):
+            return HexStr2Int(transaction['value'])
+        else:
+            raise Exception(f"Unknown format for value: {transaction['value']}")
+
     def __init__(self, nft_tokenID, network):
         self.id = nft_tokenID
         self.network = network
@@ -29,9 +46,9 @@ class NFT:
         self.statuses = []
         self.txhashes = []
         
-    def update_nft(self, user_addr:int, nft_date:datetime, nft_from:int, nft_to:int, nft_contractAddress:int, nft_tokenValue:int, nft_tokenName:str, transaction:dict):
+    def update_nft(self, user_addr:int, nft_date:datetime, nft_from:int, nft_to:int, nft_contractAddress:int, nft_tokenValue:int, nft_tokenName:str, transaction:dict, nft_value:int=None):
         if nft_to == nft_from:
-            print(f"Likely test transaction on {self.network}, take no action")
+            EVENTS.debug('self_transfer', f"Likely test transaction on {self.network}, take no action", nft=self.id, network=self.network)
             return
         self.dates.append(nft_date)
         self.froms.append(nft_from)
@@ -43,68 +60,74 @@ class NFT:
         check_dict(transaction)
         self.txhashes.append(transaction['hash'])
 
-        if type(transaction['value']) == int:
-            nft_value = transaction['value']
-        elif transaction['value'].lower().startswith('0x'):
-            nft_value = HexStr2Int(transaction['value'])
-        else:
-            raise Exception(f"Unknown format for value: {transaction['value']}")
+        if nft_value == None:
+            nft_value = NFT.get_value(transaction)
         self.values.append(nft_value)
         # breakpoint()
 
-        try:
-            if user_addr == self.froms[-1]:
-                # This NFT was sold
-                # breakpoint()
-                self.set_sold()
+        if user_addr == self.froms[-1]:
+            # This NFT was sold
+            # breakpoint()
+            self.set_sold()
 
-            elif user_addr == self.tos[-1]:
-                if self.froms[-1] == NFT.NFT_CREATION_ADR:
-                    # This NFT was created
+        elif user_addr == self.tos[-1]:
+            if self.froms[-1] == NFT.NFT_CREATION_ADR:
+                # This NFT was created
+                # breakpoint()
+                if self.tokenNames[-1] == NFT.GOV_NFT:
                     # breakpoint()
-                    if self.tokenNames[-1] == NFT.GOV_NFT:
-                        # breakpoint()
-                        self.set_gov()
-                    else:
-                        self.set_created()
+                    self.set_gov()
                 else:
-                    # This NFT was bought
-                    # breakpoint()
-                    self.set_bought()
+                    self.set_created()
             else:
-                raise Exception(f'Address {user_addr} is not in to or from for nft {self.id}')
-        except Exception as e:
-            print_error(e)
-            print(f'List of transactions: {[Int2HexStr(i) for i in self.txhashes]}')
-            # breakpoint()
+                # This NFT was bought
+                # breakpoint()
+                self.set_bought()
+        else:
+            self.set_anomaly('unknown_address', f'Address {Int2HexStr(user_addr)} is not in to or from for nft {self.id}')
 
-    def set_created(self):
-        if len(self.statuses) != 0:
-            raise Exception(f'NFT {self.id} has incompatible status to be created')
+    def set_anomaly(self, kind:str, message:str):
+        """
+            Record a transfer that does not fit the NFT history. It gets the
+            ANOMALY status, so that statuses stay aligned with the other lists
+            and the transfer counts neither as a sale nor as a purchase
+        """
+        txhash = self.txhashes[-1]
+        EVENTS.warning(kind, message, nft=self.id, network=self.network, txhash=Int2HexStr(txhash) if type(txhash) == int else txhash)
+        self.statuses.append(NFT.ANOMALY)
 
-        if self.values[-1] != 0:
-            raise Exception(f'NFT {self.id} is created but there is money involved')
+    def get_known_statuses(self) -> list[str]:
+        return [status for status in self.statuses if status != NFT.ANOMALY]
 
-        self.statuses.append(NFT.CREATED)
+    def set_created(self):
+        if len(self.get_known_statuses()) != 0:
+            self.set_anomaly('incompatible_status', f'NFT {self.id} has incompatible status to be created')
+        elif self.values[-1] != 0:
+            self.set_anomaly('created_with_value', f'NFT {self.id} is created but there is money involved')
+        else:
+            self.statuses.append(NFT.CREATED)
 
     def set_sold(self):
-        if (len(self.statuses) == 0) or self.is_gov():
-            raise Exception(f'NFT {self.id} has incompatible status to be sold')
-        if self.values[-1] == 0:
-            raise Exception(f'NFT {self.id} is sold but for no money')
-        self.statuses.append(NFT.SOLD)
+        if (len(self.get_known_statuses()) == 0) or self.is_gov():
+            self.set_anomaly('incompatible_status', f'NFT {self.id} has incompatible status to be sold')
+        elif self.values[-1] == 0:
+            self.set_anomaly('zero_value_sale', f'NFT {self.id} is sold but for no money')
+        else:
+            self.statuses.append(NFT.SOLD)
 
     def set_bought(self):
         if self.is_gov():
-            raise Exception(f'NFT {self.id} has incompatible status to be bought')
-        if self.values[-1] == 0:
-            raise Exception(f'NFT {self.id} is bought but for no money')
-        self.statuses.append(NFT.BOUGHT)
+            self.set_anomaly('incompatible_status', f'NFT {self.id} has incompatible status to be bought')
+        elif self.values[-1] == 0:
+            self.set_anomaly('zero_value_purchase', f'NFT {self.id} is bought but for no money')
+        else:
+            self.statuses.append(NFT.BOUGHT)
 
     def set_gov(self):
         if self.was_ever_sold() or self.was_ever_bought():
-            raise Exception(f'NFT {self.id} has incompatible status to be a governance NFT')
-        self.statuses.append(NFT.GOV)
+            self.set_anomaly('incompatible_status', f'NFT {self.id} has incompatible status to be a governance NFT')
+        else:
+            self.statuses.append(NFT.GOV)
 
     def get_nr_sales(self) -> int:
         nr_sales = 0
@@ -142,13 +165,14 @@ class NFT:
 
     
     def was_ever_created(self) -> bool:
-        if len(self.statuses) == 0:
+        statuses = self.get_known_statuses()
+        if len(statuses) == 0:
             return False
         # Creation can only be the first transaction
-        for i in range(1,len(self.statuses)):
-            if self.statuses[i] == NFT.CREATED:
+        for i in range(1,len(statuses)):
+            if statuses[i] == NFT.CREATED:
                 raise Exception(f'NFT {self.id} has creation at trans {i} > 0')
-        if not self.statuses[0] == NFT.CREATED:
+        if not statuses[0] == NFT.CREATED:
             return False
         return True
     
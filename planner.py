@@ -0,0 +1,137 @@
+from datetime import timedelta
+from tqdm import tqdm
+
+from .blockchainscan import BlockChainScan
+from .eventlogs import BLOCK_STEP, decode_transfer_logs, count_lookups
+from .utils import Int2HexStr, HexStr2Int
+from .events import EVENTS
+
+# Token transfer lists retrieved per wallet (ERC1155 and ERC721),
+# at least one call each
+TOKEN_LISTS = ['token1155tx', 'tokennfttx']
+
+
+def get_balances(wallets:list[int], bs:BlockChainScan) -> dict:
+    """
+        Balances of the wallets in batches of BALANCEMULTI_MAX addresses per call
+    """
+    balances = {}
+    for i in range(0, len(wallets), bs.BALANCEMULTI_MAX):
+        batch = wallets[i:i+bs.BALANCEMULTI_MAX]
+        result = bs.get_POL_balance(batch)
+        if result == None:
+            raise Exception(f'Could not retrieve the balances of {len(batch)} wallets')
+        if len(batch) == 1:
+            balances[batch[0]] = int(result[0]['balance'])
+        else:
+            for balance in result:
+                balances[HexStr2Int(balance['account'])] = int(balance['balance'])
+    return balances
+
+def estimate_calls(nonce:int, page_size:int) -> int:
+    """
+        Calls needed to paginate a wallet history. The nonce only counts
+        the outgoing transactions, so this is a lower bound
+    """
+    return nonce // page_size + 1 + len(TOKEN_LISTS)
+
+def plan_wallets(wallets:list[int], bs:BlockChainScan) -> dict:
+    """
+        Cheap pre-pass estimating the size of the history of each wallet
+        from its transaction count, the balances (batched) are kept for printing.
+        The count only covers the transactions sent, so wallets that never sent
+        one are probed for incoming tokens and skipped only if they have no token
+        transfer at all. The others are scheduled with the biggest histories first
+    """
+    balances = get_balances(wallets, bs)
+
+    estimates = {}
+    skipped = []
+    probe_calls = 0
+    for wallet in tqdm(wallets, desc='Planning', unit='wallet', disable=EVENTS.quiet):
+        result = bs.get_transaction_count(wallet)
+        # If the count is not available we have to paginate anyway
+        nonce = HexStr2Int(result) if type(result) == str else 0
+        if result != None and nonce == 0:
+            # Tokens may have been received (mint, airdrop, gift) without sending anything
+            probes = []
+            for action in TOKEN_LISTS:
+                probes.append(bs.has_ERC_token_transfers(action, wallet))
+                probe_calls += 1
+                if probes[-1] != False:
+                    break
+            if all(probe == False for probe in probes):
+                skipped.append(wallet)
+                continue
+        estimates[wallet] = estimate_calls(nonce, bs.PAGE_SIZE)
+
+    scheduled = sorted(estimates, key=lambda wallet: estimates[wallet], reverse=True)
+    prepass_calls = len(wallets) + probe_calls + (len(wallets) + bs.BALANCEMULTI_MAX - 1) // bs.BALANCEMULTI_MAX
+    plan = {
+        'wallets': scheduled,
+        'estimates': estimates,
+        'skipped': skipped,
+        'balances': balances,
+        'prepass_calls': prepass_calls,
+        'expected_calls': sum(estimates.values()),
+    }
+    print_plan(plan, bs)
+    return plan
+
+def plan_logs(wallets:list[int], contracts:list[int], bs:BlockChainScan, fromBlock:int=0, toBlock:int=None, logs:list[dict]=None, block_step:int=BLOCK_STEP) -> dict:
+    """
+        Plan of the logs backend: at least one getLogs call per block step and
+        contract plus one txlist call per contract to prefill the transactions.
+        The transactions to retrieve by hash are only known once the logs are
+        available, so they are counted with recorded logs only
+    """
+    balances = get_balances(wallets, bs)
+    lookups = None
+    if logs == None:
+        if toBlock == None:
+            toBlock = bs.get_block_number()
+            if toBlock == None:
+                raise Exception(f'Could not retrieve the last block on {bs.network}')
+        steps = -(-(toBlock - fromBlock + 1) // block_step)
+        scan_calls = steps * len(contracts) + len(contracts)
+    else:
+        scan_calls = 0
+        erc721, erc1155 = decode_transfer_logs(logs)
+        lookups = count_lookups(erc721 + erc1155, wallets)
+    plan = {
+        'balances': balances,
+        'toBlock': toBlock,
+        'scan_calls': scan_calls,
+        'lookups': lookups,
+        'prepass_calls': (len(wallets) + bs.BALANCEMULTI_MAX - 1) // bs.BALANCEMULTI_MAX,
+        'expected_calls': scan_calls + (lookups or 0),
+    }
+    print_logs_plan(plan, bs)
+    return plan
+
+def print_plan(plan:dict, bs:BlockChainScan):
+    expected_calls = plan['expected_calls']
+    eta = timedelta(seconds=int(expected_calls / bs.calls_sec))
+    EVENTS.info('plan', f"Plan on {bs.network}: {len(plan['wallets'])} wallets to fetch, {len(plan['skipped'])} without activity skipped", network=bs.network, wallets=len(plan['wallets']), skipped=len(plan['skipped']), expected_calls=expected_calls)
+    for wallet in plan['skipped']:
+        EVENTS.info('plan_skip', f'Skipping {Int2HexStr(wallet)}: no transaction sent and no token transfer', address=Int2HexStr(wallet))
+    EVENTS.info('plan_eta', f"Expected calls: at least {expected_calls} (plus {plan['prepass_calls']} for planning), ETA {eta} at {bs.calls_sec} calls/sec", network=bs.network, eta_sec=eta.total_seconds())
+    print_quota(plan, bs)
+
+def print_logs_plan(plan:dict, bs:BlockChainScan):
+    expected_calls = plan['expected_calls']
+    eta = timedelta(seconds=int(expected_calls / bs.calls_sec))
+    if plan['lookups'] == None:
+        EVENTS.info('plan', f"Plan on {bs.network}: at least {plan['scan_calls']} calls to scan the logs, plus one per transaction of the tracked wallets not sent to the contracts", network=bs.network, scan_calls=plan['scan_calls'], expected_calls=expected_calls)
+    else:
+        EVENTS.info('plan', f"Plan on {bs.network}: {plan['lookups']} transactions to retrieve by hash from the recorded logs", network=bs.network, lookups=plan['lookups'], expected_calls=expected_calls)
+    EVENTS.info('plan_eta', f"Expected calls: at least {expected_calls} (plus {plan['prepass_calls']} for planning), ETA {eta} at {bs.calls_sec} calls/sec", network=bs.network, eta_sec=eta.total_seconds())
+    print_quota(plan, bs)
+
+def print_quota(plan:dict, bs:BlockChainScan):
+    if bs.calls_day != None:
+        total_calls = plan['expected_calls'] + plan['prepass_calls']
+        if total_calls > bs.calls_day:
+            EVENTS.warning('plan_quota', f'WARNING: the run needs at least {total_calls} calls, more than the daily quota of {bs.calls_day}', network=bs.network, calls=total_calls, calls_day=bs.calls_day)
+        else:
+            EVENTS.info('plan_quota', f'The run fits the daily quota of {bs.calls_day} calls', network=bs.network, calls=total_calls, calls_day=bs.calls_day)
@@ -0,0 +1,159 @@
+from datetime import date, timedelta
+from pathlib import Path
+
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from .history import read_history
+from .blockchain_metrics import WEI_TO_POL
+from .nft import NFT
+from .utils import ratio
+from .events import EVENTS
+
+BUCKETS = ['day', 'week', 'month']
+# Next bucket tried when there are too many points
+COARSER = {'day': 'week', 'week': 'month'}
+# Points per trace above which consecutive buckets are merged
+MAX_POINTS = 2000
+
+
+def bucket_start(day:date, bucket:str) -> date:
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    raise Exception(f'Bucket {bucket} not supported')
+
+
+def next_bucket(start:date, bucket:str) -> date:
+    if bucket == 'day':
+        return start + timedelta(days=1)
+    if bucket == 'week':
+        return start + timedelta(days=7)
+    if bucket == 'month':
+        return (start + timedelta(days=31)).replace(day=1)
+    raise Exception(f'Bucket {bucket} not supported')
+
+
+def new_bin() -> dict:
+    return {'sales': 0, 'purchases': 0, 'revenue': 0, 'costs': 0, 'wallets': set()}
+
+
+def merge_bin(merged:dict, other:dict):
+    for key in ['sales', 'purchases', 'revenue', 'costs']:
+        merged[key] += other[key]
+    merged['wallets'].update(other['wallets'])
+
+
+def bin_history(filenames:list[str], bucket:str) -> dict:
+    """
+        Aggregate the stored transfers per time bucket while reading them,
+        so that the transfers themselves are never all in memory
+    """
+    bins = {}
+    nr_rows = 0
+    for filename in filenames:
+        for row in read_history(filename):
+            start = bucket_start(row['date'].date(), bucket)
+            if start not in bins:
+                bins[start] = new_bin()
+            current = bins[start]
+            if row['status'] == NFT.SOLD:
+                current['sales'] += 1
+                current['revenue'] += row['value']
+            elif row['status'] == NFT.BOUGHT:
+                current['purchases'] += 1
+                current['costs'] += row['value']
+            current['wallets'].add(row['wallet'])
+            nr_rows += 1
+    EVENTS.info('report_bins', f'{nr_rows} transfers in {len(bins)} buckets of one {bucket}', count=nr_rows, bins=len(bins))
+    return bins
+
+
+def fill_bins(bins:dict, bucket:str) -> dict:
+    """
+        Every bucket between the first and the last one, the buckets
+        without activity are zero so that the plots do not bridge them
+    """
+    if len(bins) == 0:
+        return {}
+    filled = {}
+    start = min(bins)
+    last = max(bins)
+    while start <= last:
+        filled[start] = bins.get(start, new_bin())
+        start = next_bucket(start, bucket)
+    return filled
+
+
+def rebin(bins:dict, start_of) -> dict:
+    """
+        Merge the bins into the coarser buckets given by start_of(start)
+    """
+    coarse = {}
+    for start in sorted(bins):
+        coarse_start = start_of(start)
+        if coarse_start not in coarse:
+            coarse[coarse_start] = new_bin()
+        merge_bin(coarse[coarse_start], bins[start])
+    return coarse
+
+
+def downsample(bins:dict, bucket:str, max_points:int=MAX_POINTS) -> tuple[list[tuple], str]:
+    """
+        Plot at most max_points by moving to a coarser bucket (week, then month,
+        then several months), so that every point covers the same time span.
+        Returns the points and the bucket they cover
+    """
+    filled = fill_bins(bins, bucket)
+    bins = filled
+    label = bucket
+    while len(bins) > max_points and label in COARSER:
+        # Always from the requested buckets, so that no precision is lost twice
+        label = COARSER[label]
+        bins = rebin(filled, lambda start: bucket_start(start, label))
+    months = 1
+    monthly = bins
+    while len(bins) > max_points:
+        # Windows of a fixed number of months, aligned on the calendar
+        months += 1
+        def window_start(start:date) -> date:
+            index = (start.year * 12 + start.month - 1) // months * months
+            return date(index // 12, index % 12 + 1, 1)
+        bins = rebin(monthly, window_start)
+        label = f'{months} months'
+    if label != bucket:
+        EVENTS.info('report_downsampled', f'Downsampled to {len(bins)} points per {label}', points=len(bins), bucket=label)
+    points = [(start, bins[start]) for start in sorted(bins)]
+    return points, label
+
+
+def build_report(filenames:list[str], output:str='report.html', bucket:str='day', max_points:int=MAX_POINTS):
+    """
+        HTML report of sales, purchases, revenue and active wallets over time,
+        built from stored histories without fetching again
+    """
+    if bucket not in BUCKETS:
+        raise Exception(f'Bucket {bucket} not supported')
+
+    points, label = downsample(bin_history(filenames, bucket), bucket, max_points)
+    x = [start for start, _ in points]
+
+    fig = make_subplots(
+        rows=4, cols=1, shared_xaxes=True,
+        subplot_titles=['NFT sales and purchases', 'Revenues and costs (POL)', 'Active wallets', 'Sales per active wallet'],
+    )
+    # WebGL traces keep the page responsive with many points
+    fig.add_trace(go.Scattergl(x=x, y=[point['sales'] for _, point in points], name='Sales', mode='lines'), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=x, y=[point['purchases'] for _, point in points], name='Purchases', mode='lines'), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=x, y=[point['revenue']/WEI_TO_POL for _, point in points], name='Revenues', mode='lines'), row=2, col=1)
+    fig.add_trace(go.Scattergl(x=x, y=[point['costs']/WEI_TO_POL for _, point in points], name='Costs', mode='lines'), row=2, col=1)
+    fig.add_trace(go.Scattergl(x=x, y=[len(point['wallets']) for _, point in points], name='Active wallets', mode='lines'), row=3, col=1)
+    fig.add_trace(go.Scattergl(x=x, y=[ratio(point['sales'], len(point['wallets'])) for _, point in points], name='Sales per wallet', mode='lines'), row=4, col=1)
+    fig.update_layout(title=f'NFT activity per {label}', height=1000)
+
+    # The plotly library is loaded from the CDN to keep the file small
+    fig.write_html(Path(__file__).parent.joinpath(output), include_plotlyjs='cdn')
+    EVENTS.info('report_written', f'Report written to {output}', filename=output)
@@ -0,0 +1,69 @@
+import importlib.machinery
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent.joinpath('fixtures')
+
+# The modules use relative imports: the repo directory is imported as
+# the BlockChainMetrics package, whatever the name of the clone. The package
+# is registered under that name only, so that every module is loaded once
+if 'BlockChainMetrics' not in sys.modules:
+    spec = importlib.machinery.ModuleSpec('BlockChainMetrics', None, is_package=True)
+    spec.submodule_search_locations = [str(REPO)]
+    sys.modules['BlockChainMetrics'] = importlib.util.module_from_spec(spec)
+
+# Only importable once the package is registered
+from BlockChainMetrics.addresstransactions import TRANS_CACHE
+from BlockChainMetrics.utils import Int2HexStr
+
+
+class FakeScanner:
+    """
+        Stands in for BlockChainScan: every transaction is worth value
+        (unless given in values) and the lists are empty. Tests extend it
+        with the calls they need
+    """
+    network = 'test'
+    calls_sec = 5
+    calls_day = None
+    PAGE_SIZE = 100
+    BALANCEMULTI_MAX = 20
+    RESULT_WINDOW = 10000
+
+    def __init__(self, value:int=10**18, values:dict=None, head:int=0):
+        self.value = value
+        self.values = values or {}
+        self.head = head
+        self.lookups = []
+
+    def get_transaction(self, txhash):
+        self.lookups.append(txhash)
+        return {'hash': Int2HexStr(txhash, 64), 'value': hex(self.values.get(txhash, self.value))}
+
+    def get_block_number(self):
+        return self.head
+
+    def get_POL_balance(self, addresses):
+        return [{'account': Int2HexStr(address), 'balance': '0'} for address in addresses]
+
+    def get_normal_transactions(self, address, startblock=0, endblock=99999999):
+        return []
+
+    def get_ERC721_token_transfers(self, address, contract_address, startblock=0, endblock=99999999):
+        return []
+
+    def get_ERC1155_token_transfers(self, address, contract_address, startblock=0, endblock=99999999):
+        return []
+
+    def get_logs(self, contract_address, fromBlock, toBlock):
+        return []
+
+
+@pytest.fixture(autouse=True)
+def empty_transaction_cache():
+    # The cache is global, a test must not see the transactions of another
+    TRANS_CACHE.clear()
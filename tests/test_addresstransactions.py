@@ -0,0 +1,74 @@
+from conftest import FakeScanner
+from BlockChainMetrics.addresstransactions import AddressTransactions
+from BlockChainMetrics.nft import NFT
+from BlockChainMetrics.utils import Int2HexStr
+
+WALLET = 0x1111111111111111111111111111111111111111
+SELLER = 0x1111111111111111111111111111111111111112
+CONTRACT = 0x1111111111111111111111111111111111111113
+BUNDLE_TX = 0xb0
+VALUE = 9 * 10**17
+
+
+def transfer(tokenID, tokenValue=None):
+    tr = {
+        'blockNumber': '10',
+        'timeStamp': '1700000000',
+        'hash': Int2HexStr(BUNDLE_TX, 64),
+        'from': Int2HexStr(SELLER, 40),
+        'to': Int2HexStr(WALLET, 40),
+        'contractAddress': Int2HexStr(CONTRACT, 40),
+        'tokenID': f'{tokenID}',
+        'tokenName': 'Token',
+    }
+    if tokenValue != None:
+        tr['tokenValue'] = f'{tokenValue}'
+    return tr
+
+
+def bundle():
+    # One transaction buying an ERC721 token and two ERC1155 tokens
+    return {'ERC1155': [transfer(2, 1), transfer(3, 4)], 'ERC721': [transfer(1)]}
+
+
+def test_bundle_is_attributed_once():
+    bs = FakeScanner(VALUE)
+    addr_metrics = AddressTransactions(WALLET, bs, 'equal')
+    addr_metrics.parse_token_transfers(bundle())
+
+    assert bs.lookups == [BUNDLE_TX]
+    assert [nft.statuses for nft in addr_metrics.NFTs] == [[NFT.BOUGHT]] * 3
+    assert sum(nft.get_costs() for nft in addr_metrics.NFTs) == VALUE
+
+
+def test_units_attribution():
+    addr_metrics = AddressTransactions(WALLET, FakeScanner(VALUE), 'units')
+    addr_metrics.parse_token_transfers(bundle())
+
+    costs = {nft.id: nft.get_costs() for nft in addr_metrics.NFTs}
+    assert costs[NFT.gen_key(3, CONTRACT)] == 4 * costs[NFT.gen_key(1, CONTRACT)]
+    assert sum(costs.values()) == VALUE
+
+
+def test_full_attribution_counts_every_token():
+    addr_metrics = AddressTransactions(WALLET, FakeScanner(VALUE), 'full')
+    addr_metrics.parse_token_transfers(bundle())
+
+    assert sum(nft.get_costs() for nft in addr_metrics.NFTs) == 3 * VALUE
+
+
+class FailingERC1155Scanner(FakeScanner):
+
+    def get_ERC1155_token_transfers(self, address, contract_address, startblock, endblock):
+        return None
+
+    def get_ERC721_token_transfers(self, address, contract_address, startblock, endblock):
+        return [transfer(1)]
+
+
+def test_failed_token_type_keeps_the_other():
+    addr_metrics = AddressTransactions(WALLET, FailingERC1155Scanner(VALUE), 'equal')
+    assert not addr_metrics.set_token_transfers()
+
+    assert [nft.statuses for nft in addr_metrics.NFTs] == [[NFT.BOUGHT]]
+    assert addr_metrics.NFTs[0].get_costs() == VALUE
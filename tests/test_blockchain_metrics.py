@@ -0,0 +1,78 @@
+import pytest
+
+from BlockChainMetrics import blockchain_metrics
+from BlockChainMetrics.events import EVENTS
+
+WALLETS = [0x1111111111111111111111111111111111111111 + i for i in range(10)]
+SELLER = 0x1111111111111111111111111111111111111121
+BUYER = 0x1111111111111111111111111111111111111122
+
+
+def summary(wallets, sellers, buyers):
+    return {
+        'wallets': wallets,
+        'gov_nfts': 1,
+        'bought_nfts': 2,
+        'sold_nfts': 3,
+        'gains': 10**18,
+        'costs': 2 * 10**18,
+        'sellers': set(sellers),
+        'buyers': set(buyers),
+    }
+
+
+def write_shards(tmp_path, shards):
+    filenames = []
+    for shard in shards:
+        filename = str(tmp_path.joinpath(f'partial_{len(filenames)}.yaml'))
+        blockchain_metrics.write_partial(filename, summary(5, [SELLER], [BUYER]), shard)
+        filenames.append(filename)
+    return filenames
+
+
+def test_select_shard_splits_wallets():
+    shards = [blockchain_metrics.select_shard(WALLETS, (index, 3)) for index in range(3)]
+    assert sorted(sum(shards, [])) == WALLETS
+    # The slice depends on the address only, not on the order of the wallets
+    assert blockchain_metrics.select_shard(WALLETS[::-1], (1, 3)) == shards[1][::-1]
+    assert blockchain_metrics.select_shard(WALLETS, None) == WALLETS
+    with pytest.raises(Exception):
+        blockchain_metrics.select_shard(WALLETS, (3, 3))
+
+
+def test_partial_round_trip(tmp_path):
+    filename = str(tmp_path.joinpath('partial.yaml'))
+    written = summary(5, [SELLER], [BUYER, SELLER])
+    blockchain_metrics.write_partial(filename, written, (1, 2))
+
+    read = blockchain_metrics.read_partial(filename)
+    assert read.pop('shard') == (1, 2)
+    assert read == written
+
+
+def test_merge_summaries():
+    merged = blockchain_metrics.merge_summaries([summary(5, [SELLER], [BUYER]), summary(4, [SELLER], [SELLER])])
+    assert merged['wallets'] == 9
+    assert merged['sold_nfts'] == 6
+    assert merged['gains'] == 2 * 10**18
+    # A wallet active in both shards is counted once
+    assert merged['sellers'] == {SELLER}
+    assert merged['buyers'] == {BUYER, SELLER}
+
+
+@pytest.mark.parametrize('shards', [
+    [(0, 2), (0, 2)],
+    [(0, 2), (1, 3)],
+    [(0, 2), None],
+])
+def test_check_shards_rejects_invalid_merges(tmp_path, shards):
+    filenames = write_shards(tmp_path, shards)
+    with pytest.raises(Exception):
+        blockchain_metrics.merge_partials(filenames)
+
+
+def test_check_shards_warns_on_missing_shards(tmp_path):
+    filenames = write_shards(tmp_path, [(0, 3), (2, 3)])
+    warnings = EVENTS.counts.get('merge_missing_shards', 0)
+    blockchain_metrics.merge_partials(filenames)
+    assert EVENTS.counts['merge_missing_shards'] == warnings + 1
@@ -0,0 +1,82 @@
+from conftest import FIXTURES, FakeScanner
+from BlockChainMetrics import eventlogs
+from BlockChainMetrics.nft import NFT
+from BlockChainMetrics.utils import HexStr2Int, Int2HexStr
+
+WALLET_A = 0x1111111111111111111111111111111111111111
+WALLET_B = 0x1111111111111111111111111111111111111112
+RECORDED_LOGS = FIXTURES.joinpath('transfer_logs.json')
+MINT_TX = 0xa1
+
+
+class LogsScanner(FakeScanner):
+    """
+        Serves logs in the given blocks, every transaction is worth 1 POL
+        except the mint
+    """
+    RESULT_WINDOW = 4
+
+    def __init__(self, log_blocks:list=None, failing:set=None):
+        super().__init__(values={MINT_TX: 0})
+        self.log_blocks = log_blocks or []
+        self.failing = failing or set()
+        self.ranges = []
+
+    def get_logs(self, contract_address, fromBlock, toBlock):
+        self.ranges.append((fromBlock, toBlock))
+        if (fromBlock, toBlock) in self.failing:
+            return None
+        logs = [{'blockNumber': hex(block), 'topics': []} for block in self.log_blocks if fromBlock <= block <= toBlock]
+        # Like make_call, stop at the result window
+        return logs[:self.RESULT_WINDOW]
+
+
+def test_split_words_and_uint_array():
+    data = '0x' + ''.join(f'{n:064x}' for n in [64, 160, 2, 8, 9, 2, 2, 5])
+    words = eventlogs.split_words(data)
+    assert words == [64, 160, 2, 8, 9, 2, 2, 5]
+    assert eventlogs.decode_uint_array(words, words[0]) == [8, 9]
+    assert eventlogs.decode_uint_array(words, words[1]) == [2, 5]
+
+
+def test_decode_recorded_logs():
+    erc721, erc1155 = eventlogs.decode_transfer_logs(eventlogs.read_recorded_logs(RECORDED_LOGS))
+
+    # Approval and ERC20 transfer are ignored, the mint comes before the sale
+    assert [(HexStr2Int(tr['from']), HexStr2Int(tr['to']), tr['tokenID']) for tr in erc721] == [
+        (0, WALLET_A, '42'),
+        (WALLET_A, WALLET_B, '42'),
+    ]
+    assert erc721[0]['timeStamp'] == f'{1700000000 + 100}'
+
+    # TransferBatch is expanded in one transfer per token
+    assert [(tr['tokenID'], tr['tokenValue']) for tr in erc1155] == [('7', '3'), ('8', '2'), ('9', '5')]
+    assert erc1155[1]['hash'] == erc1155[2]['hash']
+    assert HexStr2Int(erc1155[1]['from']) == WALLET_B
+    assert HexStr2Int(erc1155[1]['to']) == WALLET_A
+
+
+def test_metrics_from_recorded_logs():
+    bs = LogsScanner()
+    logs = eventlogs.read_recorded_logs(RECORDED_LOGS)
+    total_metrics = eventlogs.metrics_from_logs([WALLET_A], [], bs, logs=logs)
+
+    nfts = {nft.id: nft for nft in total_metrics[0].NFTs}
+    erc721 = nfts[NFT.gen_key(42, 0x1111111111111111111111111111111111111113)]
+    assert erc721.statuses == [NFT.CREATED, NFT.SOLD]
+    assert erc721.get_revenue() == 10**18
+    # The two tokens of the batch share the value of their transaction
+    batch = [nfts[NFT.gen_key(token, 0x1111111111111111111111111111111111111114)] for token in [8, 9]]
+    assert [nft.statuses for nft in batch] == [[NFT.BOUGHT], [NFT.BOUGHT]]
+    assert sum(nft.get_costs() for nft in batch) == 10**18
+    # One lookup per transaction, not per token
+    assert len(bs.lookups) == len(set(bs.lookups))
+
+
+def test_fetch_splits_failing_and_continues_full_ranges():
+    # 6 logs in blocks 0-7 exceed the result window of 4
+    bs = LogsScanner(log_blocks=[0, 1, 2, 3, 5, 6], failing={(0, 7)})
+    logs = eventlogs.fetch_transfer_logs(bs, [1], 0, 7)
+    assert [int(log['blockNumber'], 16) for log in logs] == [0, 1, 2, 3, 5, 6]
+    # The failing range is split, the full one continues from its last block
+    assert bs.ranges == [(0, 7), (0, 3), (3, 3), (4, 7)]
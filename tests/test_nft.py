@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+from BlockChainMetrics.nft import NFT
+from BlockChainMetrics.events import EVENTS
+
+WALLET = 0x1111111111111111111111111111111111111111
+OTHER = 0x1111111111111111111111111111111111111112
+THIRD = 0x1111111111111111111111111111111111111113
+CONTRACT = 0x1111111111111111111111111111111111111114
+DATE = datetime(2024, 6, 1)
+
+
+def update(nft, tr_from, tr_to, value, tokenName='Token'):
+    nft.update_nft(WALLET, DATE, tr_from, tr_to, CONTRACT, 1, tokenName, {'hash': 0xab, 'value': value})
+
+
+def sequence_created_with_value(nft):
+    update(nft, NFT.NFT_CREATION_ADR, WALLET, 5)
+
+def sequence_sold_first(nft):
+    update(nft, WALLET, OTHER, 5)
+
+def sequence_zero_value_sale(nft):
+    update(nft, NFT.NFT_CREATION_ADR, WALLET, 0)
+    update(nft, WALLET, OTHER, 0)
+
+def sequence_zero_value_purchase(nft):
+    update(nft, OTHER, WALLET, 0)
+
+def sequence_unknown_address(nft):
+    update(nft, OTHER, THIRD, 5)
+
+def sequence_gov_bought(nft):
+    update(nft, NFT.NFT_CREATION_ADR, WALLET, 0, NFT.GOV_NFT)
+    update(nft, OTHER, WALLET, 5)
+
+
+@pytest.mark.parametrize('kind, sequence', [
+    ('created_with_value', sequence_created_with_value),
+    ('incompatible_status', sequence_sold_first),
+    ('zero_value_sale', sequence_zero_value_sale),
+    ('zero_value_purchase', sequence_zero_value_purchase),
+    ('unknown_address', sequence_unknown_address),
+    ('incompatible_status', sequence_gov_bought),
+])
+def test_anomalies_are_recorded(kind, sequence):
+    nft = NFT(NFT.gen_key(1, CONTRACT), 'test')
+    count = EVENTS.counts.get(kind, 0)
+    sequence(nft)
+
+    assert EVENTS.counts[kind] == count + 1
+    assert nft.statuses[-1] == NFT.ANOMALY
+    assert len(nft.statuses) == len(nft.values) == len(nft.froms)
+
+
+def test_self_transfer_is_ignored():
+    nft = NFT(NFT.gen_key(1, CONTRACT), 'test')
+    count = EVENTS.counts.get('self_transfer', 0)
+    update(nft, WALLET, WALLET, 5)
+
+    assert EVENTS.counts['self_transfer'] == count + 1
+    assert nft.statuses == nft.values == nft.froms == []
+
+
+def test_anomalies_keep_values_aligned():
+    nft = NFT(NFT.gen_key(1, CONTRACT), 'test')
+    update(nft, OTHER, WALLET, 0)
+    update(nft, OTHER, WALLET, 5)
+    update(nft, WALLET, OTHER, 7)
+
+    assert nft.statuses == [NFT.ANOMALY, NFT.BOUGHT, NFT.SOLD]
+    # Without the anomaly status the purchase would get the value of the first transfer
+    assert nft.get_costs() == 5
+    assert nft.get_revenue() == 7
+    assert nft.get_buyers() == [WALLET]
+    assert nft.get_sellers() == [WALLET]
@@ -0,0 +1,38 @@
+from conftest import FIXTURES, FakeScanner
+from BlockChainMetrics import planner
+from BlockChainMetrics.eventlogs import read_recorded_logs
+
+WALLETS = [0x1111111111111111111111111111111111111111 + i for i in range(45)]
+
+
+class BalanceScanner(FakeScanner):
+    calls_day = 20
+
+    def __init__(self):
+        super().__init__(head=250_000)
+        self.batches = []
+
+    def get_POL_balance(self, addresses):
+        self.batches.append(len(addresses))
+        return super().get_POL_balance(addresses)
+
+
+def test_plan_logs_counts_block_steps():
+    bs = BalanceScanner()
+    plan = planner.plan_logs(WALLETS, [1, 2], bs, fromBlock=0)
+
+    # Balances are batched within BALANCEMULTI_MAX
+    assert bs.batches == [20, 20, 5]
+    assert len(plan['balances']) == len(WALLETS)
+    # 3 block steps per contract and one prefill each
+    assert plan['toBlock'] == 250_000
+    assert plan['expected_calls'] == 3 * 2 + 2
+    assert plan['lookups'] == None
+
+
+def test_plan_logs_counts_lookups_of_recorded_logs():
+    logs = read_recorded_logs(FIXTURES.joinpath('transfer_logs.json'))
+    plan = planner.plan_logs([0x1111111111111111111111111111111111111111], [], BalanceScanner(), logs=logs)
+    # One per transaction of the wallet, none of them cached
+    assert plan['lookups'] == 4
+    assert plan['expected_calls'] == plan['lookups']
@@ -0,0 +1,39 @@
+from datetime import date, datetime
+
+from BlockChainMetrics.history import FIELDS
+from BlockChainMetrics.nft import NFT
+from BlockChainMetrics import report
+
+WALLET = '0x1111111111111111111111111111111111111111'
+
+
+def write_history(path, days):
+    lines = [','.join(FIELDS)]
+    for day in days:
+        lines.append(f"test,{WALLET},1-0x1,{datetime.combine(day, datetime.min.time()).isoformat()},0x0,{WALLET},5,{NFT.SOLD}")
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_idle_buckets_are_zero(tmp_path):
+    history = write_history(tmp_path.joinpath('history.csv'), [date(2024, 6, 1), date(2025, 1, 1)])
+    points, label = report.downsample(report.bin_history([history], 'month'), 'month')
+
+    assert label == 'month'
+    assert [start for start, _ in points][:2] == [date(2024, 6, 1), date(2024, 7, 1)]
+    assert [point['sales'] for _, point in points] == [1] + [0] * 6 + [1]
+
+
+def test_downsample_keeps_fixed_time_spans(tmp_path):
+    history = write_history(tmp_path.joinpath('history.csv'), [date(2024, 6, 1), date(2025, 1, 1)])
+    bins = report.bin_history([history], 'day')
+
+    points, label = report.downsample(bins, 'day', max_points=50)
+    assert label == 'week'
+    assert all((b[0] - a[0]).days == 7 for a, b in zip(points, points[1:]))
+    assert sum(point['sales'] for _, point in points) == 2
+
+    # Too many months: windows of several months aligned on the calendar
+    points, label = report.downsample(bins, 'day', max_points=3)
+    assert label == '4 months'
+    assert [start for start, _ in points] == [date(2024, 5, 1), date(2024, 9, 1), date(2025, 1, 1)]
@@ -0,0 +1,57 @@
+from conftest import FakeScanner
+from BlockChainMetrics.watch import MetricsWatcher
+from BlockChainMetrics.nft import NFT
+from BlockChainMetrics.utils import Int2HexStr
+
+WALLET = 0x1111111111111111111111111111111111111111
+SELLER = 0x1111111111111111111111111111111111111112
+CONTRACT = 0x1111111111111111111111111111111111111113
+
+
+class WatchedScanner(FakeScanner):
+    """
+        A chain with a single ERC721 purchase by WALLET in block 5
+    """
+
+    def __init__(self, head:int):
+        super().__init__(head=head)
+        self.failing = False
+
+    def get_ERC721_token_transfers(self, address, contract_address, startblock, endblock):
+        if self.failing and startblock <= 5 <= endblock:
+            return None
+        if not startblock <= 5 <= endblock:
+            return []
+        return [{
+            'blockNumber': '5',
+            'timeStamp': '1700000000',
+            'hash': Int2HexStr(0xab, 64),
+            'from': Int2HexStr(SELLER, 40),
+            'to': Int2HexStr(WALLET, 40),
+            'contractAddress': Int2HexStr(CONTRACT, 40),
+            'tokenID': '1',
+            'tokenName': 'Token',
+        }]
+
+
+def test_failed_range_is_fetched_again():
+    bs = WatchedScanner(head=20)
+    watcher = MetricsWatcher([bs], [WALLET], [CONTRACT], lag=10, block_step=4)
+
+    bs.failing = True
+    assert watcher.poll()
+    # The chunk before the failing one is kept
+    assert watcher.networks['test']['last_block'] == 3
+
+    bs.failing = False
+    assert watcher.poll()
+    # The range stops lag blocks behind the head
+    assert watcher.networks['test']['last_block'] == 10
+    nfts = watcher.networks['test']['metrics'][0].NFTs
+    assert [nft.statuses for nft in nfts] == [[NFT.BOUGHT]]
+
+    # Nothing new: the purchase is not applied twice
+    bs.head = 30
+    assert watcher.poll()
+    assert [nft.statuses for nft in nfts] == [[NFT.BOUGHT]]
+    assert watcher.update_metrics()['bought_nfts'] == 1
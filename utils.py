@@ -7,10 +7,10 @@ def read_yaml(filename):
         settings = yaml.load(settings, Loader=yaml.Loader)
     return settings
 
-def print_error(error):
-    print('ERROR!!')
-    print(error)
-    print("\n")
+def write_yaml(filename, data):
+    full_file_path = Path(__file__).parent.joinpath(filename)
+    with open(full_file_path, 'w') as out:
+        yaml.safe_dump(data, out, sort_keys=False)
 
 def HexStr2Int(hexstring:str) -> int:
     if hexstring.lower() == '0x':
@@ -37,6 +37,15 @@ def check_dict(tr):
         print(f"Expected non-empty dict but got {tr}: likely some problem with the http call")
         breakpoint()
 
+def ratio(num:float, den:float) -> float:
+    """
+        Division that returns 0 for an empty denominator,
+        e.g. a shard without any sale
+    """
+    if den == 0:
+        return 0
+    return num/den
+
 def make_percentage(nmbr:float, digits:int=2)-> float:
 
     return int(nmbr*100*(10**digits))/100
\ No newline at end of file
@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .blockchainscan import BlockChainScan
+from .addresstransactions import AddressTransactions
+from .eventlogs import BLOCK_STEP, fetch_split, fetch_transfer_logs, decode_transfer_logs, prefill_transactions, split_per_wallet
+from .blockchain_metrics import SETTINGS_FILE, WEI_TO_POL, create_scanner, select_shard, aggregate_metrics, print_summary
+from .utils import read_yaml, ratio, Int2HexStr
+from .events import EVENTS
+
+DEFAULT_INTERVAL = 15
+DEFAULT_PORT = 8000
+DEFAULT_LAG = 10
+
+
+def summary_to_json(summary:dict) -> dict:
+    """
+        JSON friendly version of a summary: sets are replaced by their size
+        and the averages printed by print_summary are added
+    """
+    total_addrs = summary['wallets']
+    return {
+        'wallets': total_addrs,
+        'gov_nfts': summary['gov_nfts'],
+        'bought_nfts': summary['bought_nfts'],
+        'sold_nfts': summary['sold_nfts'],
+        'gains_wei': summary['gains'],
+        'costs_wei': summary['costs'],
+        'sellers': len(summary['sellers']),
+        'buyers': len(summary['buyers']),
+        'avg_gov_nfts': ratio(summary['gov_nfts'], total_addrs),
+        'avg_bought_nfts': ratio(summary['bought_nfts'], total_addrs),
+        'avg_sold_nfts': ratio(summary['sold_nfts'], total_addrs),
+        'avg_revenue_per_wallet_pol': ratio(summary['gains']/WEI_TO_POL, total_addrs),
+        'avg_revenue_per_nft_pol': ratio(summary['gains']/WEI_TO_POL, summary['sold_nfts']),
+        'avg_cost_per_wallet_pol': ratio(summary['costs']/WEI_TO_POL, total_addrs),
+        'avg_cost_per_nft_pol': ratio(summary['costs']/WEI_TO_POL, summary['bought_nfts']),
+    }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.watcher.get_metrics()).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', f'{len(body)}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Do not print a line per request
+        pass
+
+
+class MetricsWatcher:
+    """
+        Keeps the NFT state of the wallets and the aggregates up to date,
+        fetching only the blocks added since the last poll. New transfers are
+        queried per contract, not per wallet, so a poll costs a few calls per
+        contract plus one lookup per new transaction of the tracked wallets
+    """
+
+    def __init__(self, scanners:list[BlockChainScan], wallets:list[int], contracts:list[int], backend:str='account', fromBlock:int=0, attribution:str='equal', lag:int=DEFAULT_LAG, block_step:int=BLOCK_STEP):
+        self.wallets = wallets
+        # First block of the initial fetch
+        self.fromBlock = fromBlock
+        # Blocks left behind the head, the explorer indexes lag behind the chain
+        self.lag = lag
+        # Blocks fetched at once, the initial fetch may cover a long history
+        self.block_step = block_step
+        self.contracts = contracts
+        self.backend = backend
+        self.networks = {}
+        for bs in scanners:
+            self.networks[bs.network] = {
+                'bs': bs,
+                'metrics': [AddressTransactions(wallet, bs, attribution) for wallet in wallets],
+                'last_block': None,
+            }
+        self.lock = threading.Lock()
+        self.metrics = None
+
+    def fetch_transfers(self, bs:BlockChainScan, startblock:int, endblock:int):
+        """
+            ERC721 and ERC1155 transfers of the contracts in the block range,
+            raises if any of them could not be retrieved
+        """
+        if self.backend == 'logs':
+            erc721, erc1155 = decode_transfer_logs(fetch_transfer_logs(bs, self.contracts, startblock, endblock))
+        else:
+            erc721 = []
+            erc1155 = []
+            for contract in self.contracts:
+                erc721.extend(fetch_split(lambda start, end: bs.get_ERC721_token_transfers(None, contract, start, end), startblock, endblock, bs.RESULT_WINDOW, f'ERC721 transfers of {Int2HexStr(contract)}'))
+                erc1155.extend(fetch_split(lambda start, end: bs.get_ERC1155_token_transfers(None, contract, start, end), startblock, endblock, bs.RESULT_WINDOW, f'ERC1155 transfers of {Int2HexStr(contract)}'))
+        prefill_transactions(bs, self.contracts, startblock, endblock)
+        return erc721, erc1155
+
+    def fetch_blocks(self, state:dict, startblock:int, endblock:int):
+        """
+            Retrieve everything needed for the block range first, the NFTs
+            are updated only if all the calls succeeded
+        """
+        erc721, erc1155 = self.fetch_transfers(state['bs'], startblock, endblock)
+        wallets = [addr_metrics.address for addr_metrics in state['metrics']]
+        erc721_per_wallet = split_per_wallet(erc721, wallets)
+        erc1155_per_wallet = split_per_wallet(erc1155, wallets)
+        prepared = []
+        for addr_metrics in state['metrics']:
+            transfers = {'ERC1155': erc1155_per_wallet[addr_metrics.address], 'ERC721': erc721_per_wallet[addr_metrics.address]}
+            prepared.append((addr_metrics, addr_metrics.prepare_token_transfers(transfers)))
+
+        for addr_metrics, wallet_prepared in prepared:
+            addr_metrics.apply_token_transfers(wallet_prepared)
+
+    def poll(self) -> bool:
+        """
+            Fetch the new blocks of every network in chunks of block_step blocks,
+            returns whether anything changed. The last block is saved after each
+            chunk, a chunk that fails is retried alone at the next poll
+        """
+        updated = False
+        for network, state in self.networks.items():
+            try:
+                head = state['bs'].get_block_number()
+            except Exception as e:
+                EVENTS.error('no_block_number', f'Could not retrieve the last block on {network}, retrying later: {e}', network=network, error=f'{e}')
+                continue
+            if head == None:
+                EVENTS.warning('no_block_number', f'Could not retrieve the last block on {network}, retrying later', network=network)
+                continue
+            last_block = head - self.lag
+            startblock = self.fromBlock if state['last_block'] == None else state['last_block'] + 1
+            # Bounded chunks: a failing range is retried alone, not with all the blocks added since
+            while startblock <= last_block:
+                endblock = min(startblock + self.block_step - 1, last_block)
+                EVENTS.info('watch_fetch', f'Fetching blocks {startblock}-{endblock} on {network}', network=network, startblock=startblock, endblock=endblock)
+                try:
+                    self.fetch_blocks(state, startblock, endblock)
+                except Exception as e:
+                    EVENTS.error('watch_fetch_failed', f'Fetching blocks {startblock}-{endblock} on {network} failed, retrying later: {e}', network=network, startblock=startblock, endblock=endblock, error=f'{e}')
+                    break
+                state['last_block'] = endblock
+                updated = True
+                startblock = endblock + 1
+        return updated
+
+    def update_metrics(self):
+        total_metrics = []
+        for state in self.networks.values():
+            total_metrics.extend(state['metrics'])
+        summary = aggregate_metrics(total_metrics, len(self.wallets))
+        metrics = summary_to_json(summary)
+        metrics['last_blocks'] = {network: state['last_block'] for network, state in self.networks.items()}
+        metrics['updated'] = datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            self.metrics = metrics
+        return summary
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return self.metrics
+
+
+def watch_metrics(filename, doContracts, network, interval:int=DEFAULT_INTERVAL, port:int=DEFAULT_PORT, settings_file=SETTINGS_FILE, backend:str='account', fromBlock:int=0, shard:tuple[int,int]=None, attribution:str='equal', lag:int=DEFAULT_LAG):
+    """
+        Long running version of calculate_metrics: after a first full fetch,
+        polls every interval seconds for new blocks and serves the
+        aggregates as JSON on http://localhost:<port>/metrics
+    """
+    if network == 'all':
+        networks = ['sepolia', 'polygon']
+    else:
+        networks = [network]
+
+    scanners = [create_scanner(network, settings_file) for network in networks]
+
+    addresses = read_yaml(filename)
+    if 'contracts' not in addresses or not addresses['contracts']:
+        raise Exception(f'Watch mode queries the new transfers per contract, list them under contracts in {filename}')
+    contracts = addresses['contracts']
+    if doContracts:
+        wallets = scanners[0].get_wallets(contracts)
+    else:
+        wallets = addresses['wallets']
+    wallets = select_shard(wallets, shard)
+
+    watcher = MetricsWatcher(scanners, wallets, contracts, backend, fromBlock, attribution, lag)
+    watcher.poll()
+    print_summary(watcher.update_metrics())
+
+    server = ThreadingHTTPServer(('localhost', port), MetricsHandler)
+    server.watcher = watcher
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    EVENTS.info('watch_serve', f'Serving metrics on http://localhost:{port}/metrics, polling every {interval} s', port=port, interval=interval)
+
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                if watcher.poll():
+                    watcher.update_metrics()
+            except Exception as e:
+                # Keep serving the last metrics, the blocks are fetched again at the next poll
+                EVENTS.error('watch_poll_failed', f'Poll failed, retrying later: {e}', error=f'{e}')
+    except KeyboardInterrupt:
+        EVENTS.info('watch_stop', 'Stopping')
+    finally:
+        server.shutdown()